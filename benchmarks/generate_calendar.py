@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import random
+from datetime import date, datetime, timedelta
+
+# writes a synthetic .ics plus matching client_list_and_info.json and my_info.json
+# so the parser and invoice creator can be timed at arbitrary sizes
+
+WEEKDAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+
+def client_ids(count):
+    # AA, AB, ... ZZ, then AAA, ... always unique and never a prefix+space of each other
+    ids = []
+    length = 2
+    while len(ids) < count:
+        for i in range(26 ** length):
+            name = ''
+            n = i
+            for _ in range(length):
+                name = chr(ord('A') + n % 26) + name
+                n //= 26
+            ids.append(name)
+            if len(ids) == count:
+                break
+        length += 1
+    return ids
+
+
+def format_dt(value):
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def generate(out_dir, events=1000, clients=50, recurring_ratio=0.3, exdate_density=0.1,
+             years=2, noise_ratio=0.2, end_date=None, seed=0):
+    rng = random.Random(seed)
+    end_date = end_date or date.today().replace(day=1)
+    start_date = end_date - timedelta(days=365 * years)
+    span = (end_date - start_date).days
+
+    ids = client_ids(clients)
+    os.makedirs(out_dir, exist_ok=True)
+
+    client_data = {
+        client_id: {'name': f'Client {client_id}', 'rate': rng.choice([55, 60, 65.5, 70]), 'parking rate': rng.choice([3, 4.5, 6])}
+        for client_id in ids
+    }
+    with open(os.path.join(out_dir, 'client_list_and_info.json'), 'w') as f:
+        json.dump(client_data, f, indent=2)
+    with open(os.path.join(out_dir, 'my_info.json'), 'w') as f:
+        json.dump({'name': 'Bench Provider', 'mailing_address': '1 Bench St', 'phone_number': '555-0100'}, f, indent=2)
+
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//data_process_ical//benchmark//EN']
+    for i in range(events):
+        day = start_date + timedelta(days=rng.randrange(span))
+        start = datetime(day.year, day.month, day.day, rng.randrange(8, 17), rng.choice([0, 15, 30, 45]))
+        end = start + timedelta(minutes=rng.choice([60, 90, 120, 180]))
+
+        if rng.random() < noise_ratio:
+            summary = rng.choice(['Dentist', 'Lunch', 'Team meeting', 'Gym'])
+        else:
+            summary = f"{rng.choice(ids)} {rng.choice(['session', 'session park', 'home visit'])}"
+
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:bench-{i}@data_process_ical',
+            f'SUMMARY:{summary}',
+            f'DTSTART:{format_dt(start)}',
+            f'DTEND:{format_dt(end)}',
+        ]
+        if rng.random() < recurring_ratio:
+            rule = f"FREQ=WEEKLY;INTERVAL={rng.choice([1, 1, 2])};BYDAY={WEEKDAYS[start.weekday()]}"
+            if rng.random() < 0.5:
+                until = start + timedelta(days=rng.randrange(30, 365 * years))
+                rule += f';UNTIL={format_dt(until)}'
+            lines.append(f'RRULE:{rule}')
+            # exdates on some of the following weeks
+            week = 1
+            while week < 52 * years:
+                if rng.random() < exdate_density:
+                    lines.append(f'EXDATE:{format_dt(start + timedelta(weeks=week))}')
+                week += 1
+        lines.append('END:VEVENT')
+    lines.append('END:VCALENDAR')
+
+    ics_path = os.path.join(out_dir, 'calendar.ics')
+    with open(ics_path, 'w', newline='') as f:
+        f.write('\r\n'.join(lines) + '\r\n')
+
+    return {
+        'ics': ics_path,
+        'client_list': os.path.join(out_dir, 'client_list_and_info.json'),
+        'my_info': os.path.join(out_dir, 'my_info.json'),
+        'end_date': end_date.isoformat(),
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--recurring-ratio', type=float, default=0.3)
+    parser.add_argument('--exdate-density', type=float, default=0.1)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--noise-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic calendar and client list')
+    parser.add_argument('out_dir')
+    add_arguments(parser)
+    args = parser.parse_args()
+    paths = generate(args.out_dir, args.events, args.clients, args.recurring_ratio, args.exdate_density,
+                     args.years, args.noise_ratio, seed=args.seed)
+    print(json.dumps(paths, indent=2))
@@ -0,0 +1,152 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from generate_calendar import add_arguments, generate  # noqa: E402
+
+# times every stage of the pipeline separately on a synthetic calendar and writes
+# the results as JSON so runs can be compared across versions
+
+
+def timed(func, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, {'min': min(times), 'median': statistics.median(times), 'runs': repeat}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix='ical_bench_')
+    paths = generate(work_dir, args.events, args.clients, args.recurring_ratio, args.exdate_density,
+                     args.years, args.noise_ratio, seed=args.seed)
+    # invoice the last full month of the generated history
+    last_month = date.fromisoformat(paths['end_date']) - timedelta(days=1)
+    period = (last_month.year, last_month.month)
+
+    # invoices are written relative to the working directory
+    os.chdir(work_dir)
+    from InvoiceApp import InvoiceApp
+    from overlap_detector import detect_overlaps
+
+    stages = {}
+    app, stages['construct'] = timed(lambda: InvoiceApp(paths['ics'], paths['client_list'], logger_level=logging.WARNING,
+                                                        mydatafp=paths['my_info'], month_range=(period, period)), args.repeat)
+    # construction runs load + index, rerun them on their own
+    _, stages['load_events'] = timed(app.load_events, args.repeat)
+    _, stages['build_client_index'] = timed(app.build_client_index, args.repeat)
+
+    clients = list(app.client_data)
+    filtered = {}
+
+    def filter_all():
+        for client_id in clients:
+            filtered[client_id] = app.filter_client_calendar(client_id)
+    _, stages['filter_client_calendar'] = timed(filter_all, args.repeat)
+
+    recur_data = {}
+
+    def recur_all():
+        for client_id in clients:
+            recur_data[client_id] = app.get_recur_info(filtered[client_id][1])
+    _, stages['get_recur_info'] = timed(recur_all, args.repeat)
+
+    occurrences = {}
+
+    def non_recur_all():
+        for client_id in clients:
+            occurrences[client_id] = recur_data[client_id] + app.get_non_recur_info(filtered[client_id][0])
+    _, stages['get_non_recur_info'] = timed(non_recur_all, args.repeat)
+
+    sessions = {}
+
+    def detect_all():
+        for client_id in clients:
+            sessions[client_id] = detect_overlaps(occurrences[client_id])[0]
+    _, stages['detect_overlaps'] = timed(detect_all, args.repeat)
+
+    line_items = {}
+
+    def line_items_all():
+        for client_id in clients:
+            line_items[client_id] = app.sort_data(app.build_line_items(sessions[client_id]))
+    _, stages['build_line_items'] = timed(line_items_all, args.repeat)
+
+    def bill_all():
+        for client_id in clients:
+            app.bill_client(app.client_data[client_id], line_items[client_id])
+    _, stages['bill_client'] = timed(bill_all, args.repeat)
+
+    def build_all():
+        return [app.build_invoice(app.client_data[client_id], line_items[client_id]) for client_id in clients]
+    invoices, stages['build_invoice'] = timed(build_all, args.repeat)
+
+    if args.render:
+        from markdown_creator import write_invoice_files
+
+        def render_all():
+            for invoice in invoices:
+                write_invoice_files(*invoice)
+        _, stages['render_pdf'] = timed(render_all, 1)
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'params': {
+            'events': args.events,
+            'clients': args.clients,
+            'recurring_ratio': args.recurring_ratio,
+            'exdate_density': args.exdate_density,
+            'years': args.years,
+            'noise_ratio': args.noise_ratio,
+            'seed': args.seed,
+            'period': f'{period[0]}-{period[1]:02d}',
+        },
+        'counts': {
+            'events': len(app.events),
+            'line_items': sum(len(items) for items in line_items.values()),
+        },
+        'stages': stages,
+        'work_dir': work_dir,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time each stage of the invoice pipeline on a synthetic calendar')
+    add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--render', action='store_true', help='also time PDF rendering with WeasyPrint')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
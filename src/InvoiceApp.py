@@ -1,10 +1,17 @@
 from ical_parser import IcalParser
-from markdown_creator import MarkdownCreator
+from markdown_creator import MarkdownCreator, timed_render_pdf
+from instrumentation import Instrumentation
+from billing import BillingEngine
+from ledger import Ledger
+from sharding import build_manifest, write_manifest
+from concurrent.futures import ProcessPoolExecutor
 import logging
 
 class InvoiceApp(IcalParser, MarkdownCreator):
     def __init__(self, ical_path="BI.ics", client_list_path="src/client_data/client_list_and_info.json", month=None, logger=None, logger_level=logging.DEBUG,
-                 mydatafp="src/my_info/my_info.json"):
+                 mydatafp="src/my_info/my_info.json", stream=False, cache_dir=None, incremental=False,
+                 month_range=None, track_allocations=False, combined_pdf=False, max_records=None,
+                 ledger_path=None, shard=None, archive=False):
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logger_level)
         if not self.logger.handlers:  # Avoid adding duplicate handlers
@@ -14,19 +21,197 @@ class InvoiceApp(IcalParser, MarkdownCreator):
             self.logger.addHandler(handler)
         self.logger.propagate = False  # Disable propagation to the root logger
 
+        # per stage / per client timings, see report() and write_trace()
+        self.instrumentation = Instrumentation(track_allocations, max_records)
+
+        # month_range: ((year, month), (year, month)) for batch_loop, starts at the first month
+        if month_range:
+            month = month_range[0][1]
+
         # Pass self.logger to IcalParser
-        IcalParser.__init__(self, ical_path, client_list_path, month, self.logger, logger_level)
-        MarkdownCreator.__init__(self, mydatafp, month, self.logger, logger_level)
-
-    def main_loop(self):
-        for key,value in self.client_data.items():
-            #debug 
-            if key == 'MLS':
-                pass
-            # get hours and dates
-            data_dict = self.calculate_hours_and_dates(key)
-
-            self.create_invoice(value,data_dict)
+        IcalParser.__init__(self, ical_path, client_list_path, month, self.logger, logger_level, stream, cache_dir, month_range,
+                            self.instrumentation, shard=shard)
+        MarkdownCreator.__init__(self, mydatafp, month, self.logger, logger_level, incremental, self.instrumentation,
+                                 combined_pdf, archive)
+        if month_range:
+            MarkdownCreator.set_invoice_period(self, *month_range[0])
+
+        # ledger_path: every run also stores its line items in a sqlite ledger, see ledger.py
+        self.ledger = Ledger(ledger_path, self.logger) if ledger_path else None
+        # outputs and totals per client and period of a sharded run, see write_shard_manifest
+        self.shard_clients = {}
+
+    def set_invoice_period(self, year, month):
+        IcalParser.set_invoice_period(self, year, month)
+        MarkdownCreator.set_invoice_period(self, year, month)
+
+    def main_loop(self, workers=None):
+        with self.instrumentation.stage('run'):
+            client_items = ((key, value, self.calculate_hours_and_dates(key)) for key,value in self.client_data.items())
+            engine = None
+            if self.ledger is not None or self.shard is not None:
+                engine = BillingEngine()
+                client_items = self.billing_items(client_items, engine)
+
+            # workers > 1 renders the PDFs in a process pool while the next clients are parsed,
+            # a combined PDF is a single layout pass so it always runs here
+            try:
+                if workers is not None and workers > 1 and not self.combined_pdf:
+                    with ProcessPoolExecutor(max_workers=workers) as pool:
+                        results = self.parallel_loop(pool, client_items)
+                else:
+                    results = None
+                    for key,value,data_dict in client_items:
+                        self.create_invoice(value,data_dict)
+                    if self.combined_pdf:
+                        results = self.write_combined_pdf()
+            except BaseException:
+                self.close_output(abort=True)
+                raise
+            self.close_output()
+
+            if engine is not None:
+                self.record_billing(engine)
+            return results
+
+    def billing_items(self, client_items, engine):
+        # passes the client items through, collecting them for the ledger / shard manifest on the way
+        for key,value,data_dict in client_items:
+            engine.add_client(key, value, data_dict)
+            yield key, value, data_dict
+
+    def record_billing(self, engine):
+        period = self.inv_date.strftime('%Y-%m')
+        engine.compute()
+        if self.ledger is not None:
+            with self.instrumentation.stage('ledger') as record:
+                record['count'] = self.ledger.record_billing(engine, period)
+        if self.shard is not None:
+            for totals in engine.client_totals():
+                markdown_path, pdf_path = self.invoice_paths(self.client_data[totals['client_id']])
+                client = self.shard_clients.setdefault(totals['client_id'], {'name': totals['name'], 'periods': {}})
+                client['periods'][period] = {key: value for key, value in totals.items() if key not in ('client_id', 'name')}
+                client['periods'][period].update(markdown=markdown_path, pdf=pdf_path)
+
+    def write_shard_manifest(self, path, results=None):
+        # results: what main_loop / batch_loop returned, failed clients are listed as errors
+        if isinstance(results, dict):
+            results = [result for month_results in results.values() if isinstance(month_results, list) for result in month_results]
+        errors = [{'client': result['client'], 'error': result['error']} for result in results or []
+                  if isinstance(result, dict) and result['error']]
+        periods = [f'{year}-{month:02d}' for year, month in self.iter_months()]
+        manifest = build_manifest(*self.shard, periods, self.shard_clients, errors, self.instrumentation.summary())
+        return write_manifest(path, manifest)
+
+    def billing_summary(self, csv_path=None):
+        # totals for every client of the invoice period in one batch, nothing is rendered
+        engine = BillingEngine()
+        with self.instrumentation.stage('billing') as record:
+            for key,value in self.client_data.items():
+                engine.add_client(key, value, self.calculate_hours_and_dates(key))
+            engine.compute()
+            record['count'] = len(engine)
+
+        if csv_path:
+            engine.write_summary_csv(csv_path, self.inv_date.strftime('%Y-%m'))
+        if self.ledger is not None:
+            self.record_billing(engine)
+        return engine
+
+    def register_hook(self, hook):
+        # hook(record) is called with every finished stage record
+        self.instrumentation.register_hook(hook)
+
+    def report(self):
+        return self.instrumentation.report()
+
+    def write_report(self, path):
+        self.instrumentation.write_json(path)
+
+    def write_trace(self, path):
+        self.instrumentation.write_trace(path)
+
+    def profile_client(self, client_id, path=None, render=False):
+        # cProfile one client's parse (and optionally invoice build), returns pstats.Stats
+        def run_client():
+            data_dict = self.calculate_hours_and_dates(client_id)
+            if render:
+                self.create_invoice(self.client_data[client_id],data_dict)
+                self.close_output()
+            return data_dict
+
+        _, stats = self.instrumentation.profile(run_client, path=path)
+        return stats
+
+    def batch_loop(self, workers=None):
+        # every client is expanded once over the whole month_range and split by month,
+        # then each month's invoices are produced from that shared state
+        by_client = {key: self.calculate_hours_and_dates_by_month(key) for key in self.client_data}
+
+        results = {}
+        pool = ProcessPoolExecutor(max_workers=workers) if workers is not None and workers > 1 and not self.combined_pdf else None
+        try:
+            for year, month in self.iter_months():
+                self.set_invoice_period(year, month)
+                client_items = ((key, value, by_client[key].get((year, month), [])) for key,value in self.client_data.items())
+                engine = None
+                if self.ledger is not None or self.shard is not None:
+                    engine = BillingEngine()
+                    client_items = self.billing_items(client_items, engine)
+                if pool is not None:
+                    results[(year, month)] = self.parallel_loop(pool, client_items)
+                else:
+                    for key,value,data_dict in client_items:
+                        self.create_invoice(value,data_dict)
+                    if self.combined_pdf:
+                        results[(year, month)] = self.write_combined_pdf()
+                if engine is not None:
+                    self.record_billing(engine)
+            self.close_output()
+        except BaseException:
+            self.close_output(abort=True)
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        return results
+
+    def parallel_loop(self, pool, client_items):
+        jobs = []
+        for key,value,data_dict in client_items:
+            inv_hash = None
+            if self.incremental:
+                inv_hash = self.invoice_hash(value,data_dict)
+                if self.invoice_is_current(value,inv_hash):
+                    self.logger.info(f'Unchanged Invoice for {value['name']} .. Skipping')
+                    jobs.append((key, value, inv_hash, (None, None, None), None))
+                    continue
+            markdown_file, markdown_path, full_html_string, pdf_path = self.build_invoice(value,data_dict)
+            jobs.append((key, value, inv_hash, (markdown_file, markdown_path, pdf_path), pool.submit(timed_render_pdf, full_html_string)))
+
+        # collect in client order, a failed client does not stop the batch,
+        # the files are queued for the output writer as the PDFs come back
+        results = []
+        for key, value, inv_hash, (markdown_file, markdown_path, pdf_path), future in jobs:
+            if future is None:
+                results.append({'client': key, 'pdf': self.invoice_paths(value)[1], 'error': None, 'skipped': True})
+                continue
+            try:
+                pdf, seconds = future.result()
+            except Exception as e:
+                self.logger.error(f'Failed Invoice for {key}: {e!r}')
+                results.append({'client': key, 'pdf': None, 'error': repr(e), 'skipped': False})
+            else:
+                self.instrumentation.add_record({'stage': 'pdf', 'client': value['name'], 'wall': seconds})
+                self.write_output(markdown_path, markdown_file)
+                self.write_output(pdf_path, pdf)
+                if self.incremental:
+                    self.update_manifest(value,inv_hash)
+                self.logger.info(f'Finished Invoice for {key}')
+                results.append({'client': key, 'pdf': pdf_path, 'error': None, 'skipped': False})
+
+        return results
 
 if __name__ == '__main__':
     myapp = InvoiceApp(month=3)
@@ -0,0 +1,112 @@
+from array import array
+from decimal import Decimal, ROUND_HALF_UP
+import csv
+
+# billing for every client's line items in one batch: one typed column per field
+# instead of a dict per line item, all money in integer cents
+
+TRAVEL_FEE_CENTS = 300
+
+
+def to_cents(amount):
+    # via str so 65.1 is 6510 and not 6509.999...
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def format_cents(cents):
+    return f"${cents // 100}.{cents % 100:02d}" if cents >= 0 else f"-{format_cents(-cents)}"
+
+
+def line_amount_cents(seconds, rate_cents):
+    # hours * rate rounded half up to the cent, exact integer math
+    return (seconds * rate_cents * 2 + 3600) // 7200
+
+
+class BillingEngine:
+    def __init__(self, travel_fee_cents=TRAVEL_FEE_CENTS):
+        self.travel_fee_cents = travel_fee_cents
+        self.clients = []           # (client_id, name) per client index
+        self.client_rows = []       # (first row, end row) per client index, a client's rows are contiguous
+        self.client_index = array('q')
+        self.dates = array('q')     # date ordinals
+        self.seconds = array('q')
+        self.rate_cents = array('q')
+        self.parking_cents = array('q')
+        self.amount_cents = array('q')
+        self.total_cents = array('q')
+
+    def __len__(self):
+        return len(self.dates)
+
+    def add_client(self, client_id, client_info, line_items):
+        index = len(self.clients)
+        self.clients.append((client_id, client_info['name']))
+        rate_cents = to_cents(client_info['rate'])
+        parking_rate_cents = to_cents(client_info['parking rate'])
+
+        count = len(line_items)
+        self.client_rows.append((len(self.dates), len(self.dates) + count))
+        self.client_index.extend([index] * count)
+        self.dates.extend(item['date'].toordinal() for item in line_items)
+        # hours come from whole seconds, so rounding back to seconds is exact
+        self.seconds.extend(round((item['hours'] or 0) * 3600) for item in line_items)
+        self.rate_cents.extend([rate_cents] * count)
+        self.parking_cents.extend(parking_rate_cents if item['parking'] else 0 for item in line_items)
+        return index
+
+    def rows(self, index):
+        # computed line items of one client: (date ordinal, seconds, rate, amount, parking, total), money in cents
+        start, end = self.client_rows[index]
+        return zip(self.dates[start:end], self.seconds[start:end], self.rate_cents[start:end],
+                   self.amount_cents[start:end], self.parking_cents[start:end], self.total_cents[start:end])
+
+    def compute(self):
+        self.amount_cents = array('q', map(line_amount_cents, self.seconds, self.rate_cents))
+        travel = self.travel_fee_cents
+        self.total_cents = array('q', (amount + travel + parking for amount, parking in zip(self.amount_cents, self.parking_cents)))
+        return self
+
+    def client_totals(self):
+        totals = [
+            {'client_id': client_id, 'name': name, 'sessions': 0, 'seconds': 0,
+             'amount_cents': 0, 'travel_cents': 0, 'parking_cents': 0, 'total_cents': 0}
+            for client_id, name in self.clients
+        ]
+        for index, seconds, amount, parking, total in zip(self.client_index, self.seconds, self.amount_cents,
+                                                          self.parking_cents, self.total_cents):
+            client = totals[index]
+            client['sessions'] += 1
+            client['seconds'] += seconds
+            client['amount_cents'] += amount
+            client['travel_cents'] += self.travel_fee_cents
+            client['parking_cents'] += parking
+            client['total_cents'] += total
+        return totals
+
+    def grand_total(self):
+        return {
+            'sessions': len(self.dates),
+            'seconds': sum(self.seconds),
+            'amount_cents': sum(self.amount_cents),
+            'travel_cents': self.travel_fee_cents * len(self.dates),
+            'parking_cents': sum(self.parking_cents),
+            'total_cents': sum(self.total_cents),
+        }
+
+    def write_summary_csv(self, path, period=''):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['period', 'client_id', 'name', 'sessions', 'hours', 'amount', 'travel', 'parking', 'total'])
+            for client in self.client_totals() + [dict(self.grand_total(), client_id='', name='TOTAL')]:
+                writer.writerow([
+                    period,
+                    client['client_id'],
+                    client['name'],
+                    client['sessions'],
+                    f"{client['seconds'] / 3600:.2f}",
+                    format_cents(client['amount_cents']),
+                    format_cents(client['travel_cents']),
+                    format_cents(client['parking_cents']),
+                    format_cents(client['total_cents']),
+                ])
+        return path
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import os
+
+from output_writer import write_atomic
+
+# loads several calendar sources (local files or http(s)/webcal urls) concurrently,
+# urls are fetched with conditional GET so unchanged feeds keep their cached copy
+
+
+def is_url(source):
+    return source.startswith(('http://', 'https://', 'webcal://'))
+
+
+def fetch_url(url, cache_dir, logger=None, timeout=30):
+    # returns (local path of the body, changed)
+    import urllib.error
+    import urllib.request
+
+    logger = logger or logging.getLogger(__name__)
+    if url.startswith('webcal://'):
+        url = 'https://' + url[len('webcal://'):]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    name = hashlib.sha256(url.encode()).hexdigest()[:32]
+    body_path = os.path.join(cache_dir, f'{name}.ics')
+    meta_path = os.path.join(cache_dir, f'{name}.json')
+
+    meta = {}
+    if os.path.exists(body_path) and os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+    request = urllib.request.Request(url, headers={'User-Agent': 'data_process_ical'})
+    if meta.get('etag'):
+        request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        request.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            logger.debug(f'Source Unchanged: {url}')
+            return body_path, False
+        if meta:
+            logger.warning(f'Source Fetch Failed, Using Cached Copy: {url} ({e.code})')
+            return body_path, False
+        raise
+    except urllib.error.URLError as e:
+        if meta:
+            logger.warning(f'Source Fetch Failed, Using Cached Copy: {url} ({e.reason})')
+            return body_path, False
+        raise
+
+    # body first, the metadata only points at a complete file
+    write_atomic(body_path, body)
+    write_atomic(meta_path, json.dumps({'url': url, 'etag': etag, 'last_modified': last_modified}).encode())
+    logger.debug(f'Source Downloaded: {url} ({len(body)} bytes)')
+    return body_path, True
+
+
+def load_sources(sources, load_events, cache_dir, logger=None):
+    # load_events(path) turns one local .ics into EventRecords, results keep the source order
+    import asyncio
+
+    async def load_source(source):
+        path = source
+        if is_url(source):
+            path, _ = await asyncio.to_thread(fetch_url, source, cache_dir, logger)
+        return await asyncio.to_thread(load_events, path)
+
+    async def load_all():
+        return await asyncio.gather(*(load_source(source) for source in sources))
+
+    return asyncio.run(load_all())
+
+
+def merge_events(event_lists):
+    # one event set across sources: the first copy of a uid / recurrence-id per client wins,
+    # and occurrences replaced by a RECURRENCE-ID override are removed from their series
+    merged = []
+    seen = set()
+    overrides = {}
+    for events in event_lists:
+        for event in events:
+            if event.uid:
+                key = (event.client_id, event.uid, event.recurrence_id)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if event.recurrence_id is not None:
+                    overrides.setdefault((event.client_id, event.uid), set()).add(event.recurrence_id)
+            merged.append(event)
+
+    for event in merged:
+        if event.recurring and event.recurrence_id is None:
+            replaced = overrides.get((event.client_id, event.uid))
+            if replaced:
+                event.exdates = event.exdates | replaced
+
+    return merged
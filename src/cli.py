@@ -0,0 +1,250 @@
+import argparse
+from datetime import date
+import logging
+import sys
+
+# command line entry point, `hours` and `preview` only parse the calendar,
+# the rendering side (weasyprint, process pool) is only imported by `render` and `serve`
+
+DEFAULT_ICAL = "BI.ics"
+DEFAULT_CLIENTS = "src/client_data/client_list_and_info.json"
+DEFAULT_MY_INFO = "src/my_info/my_info.json"
+
+
+def parse_month(value):
+    # YYYY-MM, or just the month of the current year
+    try:
+        if '-' in value:
+            year, month = (int(part) for part in value.split('-'))
+        else:
+            year, month = date.today().year, int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid month: {value!r} (expected YYYY-MM or M)')
+    if not 1 <= month <= 12:
+        raise argparse.ArgumentTypeError(f'invalid month: {value!r} (expected YYYY-MM or M)')
+    return year, month
+
+
+def parse_month_range(value):
+    start, _, end = value.partition(':')
+    if not end:
+        raise argparse.ArgumentTypeError(f'invalid month range: {value!r} (expected YYYY-MM:YYYY-MM)')
+    return parse_month(start), parse_month(end)
+
+
+def shard_arg(value):
+    from sharding import parse_shard
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def month_range_arg(args):
+    # None keeps the parser's default of last month
+    if getattr(args, 'months', None):
+        return args.months
+    if args.month:
+        return args.month, args.month
+    return None
+
+
+def ical_arg(args):
+    if not args.ical:
+        return DEFAULT_ICAL
+    return args.ical[0] if len(args.ical) == 1 else args.ical
+
+
+def log_level(args):
+    return logging.DEBUG if args.verbose > 1 else logging.INFO if args.verbose else logging.WARNING
+
+
+def create_parser(args):
+    from ical_parser import IcalParser
+    return IcalParser(ical_arg(args), args.clients, logger_level=log_level(args), stream=args.stream,
+                      cache_dir=args.cache_dir, month_range=month_range_arg(args))
+
+
+def create_app(args, **kwargs):
+    from InvoiceApp import InvoiceApp
+    return InvoiceApp(ical_arg(args), args.clients, logger_level=log_level(args), mydatafp=args.my_info,
+                      stream=args.stream, cache_dir=args.cache_dir, month_range=month_range_arg(args), **kwargs)
+
+
+def find_client(client_data, client):
+    # by id, or by the client's name, case does not matter
+    if client in client_data:
+        return client
+    for key, value in client_data.items():
+        if client.lower() in (key.lower(), value.get('name', '').lower()):
+            return key
+    raise SystemExit(f'unknown client: {client!r} (known: {", ".join(client_data)})')
+
+
+def cmd_hours(args):
+    parser = create_parser(args)
+    client_id = find_client(parser.client_data, args.client)
+    data = parser.calculate_hours_and_dates(client_id)
+
+    print(f"{parser.client_data[client_id]['name']} - {parser.inv_date.strftime('%B %Y')}")
+    for item in data:
+        parking = '  parking' if item['parking'] else ''
+        # events without an end have no hours
+        hours = f"{item['hours']:5.2f}" if item['hours'] is not None else '    -'
+        print(f"{item['date'].isoformat()}  {hours} h{parking}")
+    print(f"Total: {sum(item['hours'] for item in data if item['hours'] is not None):.2f} h in {len(data)} sessions")
+    return 0
+
+
+def cmd_preview(args):
+    app = create_app(args)
+    client_id = find_client(app.client_data, args.client)
+    data = app.calculate_hours_and_dates(client_id)
+    markdown_file, _ = app.build_invoice_body(app.client_data[client_id], data)
+    print(markdown_file)
+    return 0
+
+
+def cmd_render(args):
+    app = create_app(args, incremental=args.incremental, combined_pdf=args.combined, ledger_path=args.ledger,
+                     shard=args.shard, archive=args.zip)
+    if args.months:
+        results = app.batch_loop(args.workers)
+    else:
+        results = app.main_loop(args.workers)
+    if args.report:
+        app.write_report(args.report)
+    if args.shard:
+        from sharding import shard_manifest_path
+        path = app.write_shard_manifest(args.shard_manifest or shard_manifest_path(*args.shard), results)
+        print(f"shard {args.shard[0]}/{args.shard[1]}: {len(app.client_data)} clients, manifest {path}")
+
+    # pooled runs report failed clients instead of raising
+    if isinstance(results, dict):
+        results = [result for month_results in results.values() if isinstance(month_results, list) for result in month_results]
+    failed = [result for result in results or [] if isinstance(result, dict) and result['error']]
+    for result in failed:
+        print(f"failed: {result['client']}: {result['error']}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def cmd_ledger(args):
+    # answered from the ledger alone, the calendar is not read
+    from ledger import Ledger
+    ledger = Ledger(args.ledger)
+    if args.months:
+        (start_year, start_month), (end_year, end_month) = args.months
+        start, end = f'{start_year}-{start_month:02d}', f'{end_year}-{end_month:02d}'
+    else:
+        year = args.year or date.today().year
+        start, end = f'{year}-01', (date.today().strftime('%Y-%m') if year == date.today().year else f'{year}-12')
+
+    if args.by_month:
+        rows = ledger.period_totals(start, end, args.client)
+        label = 'period'
+    else:
+        rows = ledger.client_totals(start, end, args.client)
+        label = 'client_id'
+    ledger.close()
+
+    print(f'{start} .. {end}')
+    for row in rows:
+        print(f"{row[label]:<12} {row['sessions']:>5} sessions {row['hours']:>8.2f} h  {row['total']:>12}")
+    return 0
+
+
+def cmd_merge_shards(args):
+    import json
+    from sharding import merge_manifests, write_manifest
+    client_data = None
+    if args.clients:
+        with open(args.clients, 'r') as f:
+            client_data = json.load(f)
+    try:
+        merged = merge_manifests(args.manifests, client_data)
+    except ValueError as e:
+        print(f'incomplete shard run:\n{e}', file=sys.stderr)
+        return 1
+    write_manifest(args.output, merged)
+    print(f"{len(merged['clients'])} clients from {merged['shards']} shards, manifest {args.output}")
+    return 0
+
+
+def cmd_serve(args):
+    from invoice_daemon import InvoiceDaemon
+    daemon = InvoiceDaemon(ical_arg(args), args.clients, args.my_info, args.host, args.port, args.poll_interval,
+                           args.cache_dir, log_level(args))
+    if args.month:
+        daemon.default_period = args.month
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def build_arg_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--ical', action='append', help='.ics path or url, repeat to merge several sources')
+    common.add_argument('--clients', default=DEFAULT_CLIENTS, help='client list json')
+    common.add_argument('--month', type=parse_month, help='invoice month, YYYY-MM or M (default: last month)')
+    common.add_argument('--cache-dir', help='keep parsed events on disk between runs')
+    common.add_argument('--stream', action='store_true', help='only keep the events of the invoice period')
+    common.add_argument('-v', '--verbose', action='count', default=0)
+
+    arg_parser = argparse.ArgumentParser(prog='invoice', description='ical client invoices')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    hours = commands.add_parser('hours', parents=[common], help="print a client's sessions and hours")
+    hours.add_argument('client', help='client id or name')
+    hours.set_defaults(func=cmd_hours)
+
+    preview = commands.add_parser('preview', parents=[common], help="print a client's invoice markdown")
+    preview.add_argument('client', help='client id or name')
+    preview.add_argument('--my-info', default=DEFAULT_MY_INFO)
+    preview.set_defaults(func=cmd_preview)
+
+    render = commands.add_parser('render', parents=[common], help='write the invoice markdown and PDFs')
+    render.add_argument('--my-info', default=DEFAULT_MY_INFO)
+    render.add_argument('--months', type=parse_month_range, help='YYYY-MM:YYYY-MM, one batch over several months')
+    render.add_argument('--workers', type=int, help='render PDFs in a process pool')
+    render.add_argument('--incremental', action='store_true', help='skip invoices that did not change')
+    render.add_argument('--combined', action='store_true', help='one PDF with every invoice')
+    render.add_argument('--zip', action='store_true', help='one zip archive per month instead of loose files')
+    render.add_argument('--report', help='write stage timings as json')
+    render.add_argument('--ledger', help='also store the line items in this sqlite ledger')
+    render.add_argument('--shard', type=shard_arg, help='i/N, only render the clients of shard i of N')
+    render.add_argument('--shard-manifest', help='default: output/shards/shard-i-of-N.json')
+    render.set_defaults(func=cmd_render)
+
+    ledger = commands.add_parser('ledger', help='totals from the sqlite ledger (default: year to date per client)')
+    ledger.add_argument('--ledger', default='output/ledger.sqlite3')
+    ledger.add_argument('--year', type=int)
+    ledger.add_argument('--months', type=parse_month_range, help='YYYY-MM:YYYY-MM')
+    ledger.add_argument('--client', help='client id')
+    ledger.add_argument('--by-month', action='store_true', help='one row per month instead of per client')
+    ledger.set_defaults(func=cmd_ledger)
+
+    merge = commands.add_parser('merge-shards', help='check and combine the manifests of a sharded run')
+    merge.add_argument('manifests', nargs='+')
+    merge.add_argument('--clients', help='client list json, every client in it must be in a shard')
+    merge.add_argument('--output', default='output/shards/manifest.json')
+    merge.set_defaults(func=cmd_merge_shards)
+
+    serve = commands.add_parser('serve', parents=[common], help='keep the calendar loaded and answer queries over http')
+    serve.add_argument('--my-info', default=DEFAULT_MY_INFO)
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--poll-interval', type=float, default=2.0, help='seconds between checks for changed files')
+    serve.set_defaults(func=cmd_serve)
+
+    return arg_parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
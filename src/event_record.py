@@ -0,0 +1,148 @@
+from datetime import datetime, date, time, timedelta
+
+
+class EventRecord:
+    # compact, normalized view of a VEVENT built once at load time so the rest of the
+    # pipeline never has to go back to the icalendar Component API
+    __slots__ = (
+        'uid',
+        'client_id',
+        'summary',
+        'start',        # date ordinal of dtstart
+        'start_time',   # wall-clock time of dtstart, None for all-day events
+        'tzinfo',       # dtstart's timezone, None for floating and all-day events
+        'start_ts',     # dtstart as epoch seconds, see to_timestamp
+        'end_ts',       # dtend as epoch seconds, None if no end
+        'duration',     # billable seconds, None if no end
+        'parking',
+        'rrule',        # parsed rrule dict, None for non-recurring events
+        'exdates',      # frozenset of date ordinals
+        'rdates',       # frozenset of date ordinals
+        'recurrence_id',  # date ordinal of the occurrence this event overrides, None otherwise
+    )
+
+    def __init__(self, uid, client_id, summary, start, start_time, tzinfo, start_ts, end_ts, duration, parking, rrule, exdates, rdates,
+                 recurrence_id=None):
+        self.uid = uid
+        self.client_id = client_id
+        self.summary = summary
+        self.start = start
+        self.start_time = start_time
+        self.tzinfo = tzinfo
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.duration = duration
+        self.parking = parking
+        self.rrule = rrule
+        self.exdates = exdates
+        self.rdates = rdates
+        self.recurrence_id = recurrence_id
+
+    @property
+    def recurring(self):
+        return self.rrule is not None or bool(self.rdates)
+
+    @property
+    def all_day(self):
+        return self.start_time is None
+
+    def timestamp_on(self, ordinal):
+        # start of the occurrence on another day at the same wall-clock time in the event's own
+        # timezone, so occurrences after a DST change still line up with copies of them
+        if ordinal == self.start:
+            return self.start_ts
+        return datetime.combine(date.fromordinal(ordinal), self.start_time or time(), self.tzinfo).timestamp()
+
+    def fingerprint(self):
+        # stable across runs, sets and the rrule dict are ordered first
+        rrule = sorted(self.rrule.items()) if self.rrule is not None else None
+        return repr((self.uid, self.client_id, self.summary, self.start, self.start_time, self.tzinfo, self.start_ts, self.end_ts, self.duration,
+                     self.parking, rrule, sorted(self.exdates), sorted(self.rdates), self.recurrence_id))
+
+    def __repr__(self):
+        return f'EventRecord({self.client_id!r}, {self.summary!r}, {date.fromordinal(self.start)})'
+
+    @classmethod
+    def from_component(cls, component, client_id):
+        summary = str(component.get('summary'))
+        dtstart = component.get('dtstart').dt
+
+        if component.get('dtend'):
+            dtend = component.get('dtend').dt
+        elif component.get('duration'):
+            dtend = dtstart + component.get('duration').dt
+        else:
+            dtend = None
+
+        if dtend is not None:
+            # same as timedelta.seconds in the original parser, whole days are not billed
+            duration = (dtend - dtstart).seconds
+            end_ts = to_timestamp(dtend)
+        else:
+            duration = None
+            end_ts = None
+
+        rrule = parse_rrule(component['RRULE']) if component.get('RRULE') else None
+
+        return cls(
+            uid=str(component.get('uid', '')),
+            client_id=client_id,
+            summary=summary,
+            start=to_date(dtstart).toordinal(),
+            start_time=dtstart.time() if isinstance(dtstart, datetime) else None,
+            tzinfo=dtstart.tzinfo if isinstance(dtstart, datetime) else None,
+            start_ts=to_timestamp(dtstart),
+            end_ts=end_ts,
+            duration=duration,
+            parking='park' in summary.lower(),
+            rrule=rrule,
+            exdates=parse_date_list(component.get('EXDATE')),
+            rdates=parse_date_list(component.get('RDATE')),
+            recurrence_id=to_date(component.get('RECURRENCE-ID').dt).toordinal() if component.get('RECURRENCE-ID') else None,
+        )
+
+
+def to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def to_timestamp(value):
+    # real epoch seconds so events in different timezones (e.g. a UTC copy of a TZID event) compare,
+    # floating times and all-day dates are taken as local time
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.combine(value, time()).timestamp()
+
+
+def parse_rrule(rrule):
+    until = rrule.get('UNTIL')
+    count = rrule.get('COUNT')
+    return {
+        'freq': rrule.get('FREQ', ['WEEKLY'])[0],
+        'interval': int(rrule.get('INTERVAL', [1])[0]),
+        'until': to_date(until[0]).toordinal() if until else None,
+        'count': int(count[0]) if count else None,
+        'byday': tuple(str(day) for day in rrule.get('BYDAY', [])),
+        'bymonthday': tuple(int(day) for day in rrule.get('BYMONTHDAY', [])),
+    }
+
+
+def parse_date_list(prop):
+    # EXDATE/RDATE can be a single vDDDLists or a list of them
+    if prop is None:
+        return frozenset()
+    if not isinstance(prop, list):
+        prop = [prop]
+    ordinals = set()
+    for date_list in prop:
+        for value in date_list.dts:
+            dt = value.dt
+            if isinstance(dt, tuple):
+                # RDATE periods, only the start matters
+                dt = dt[0]
+            if isinstance(dt, timedelta):
+                continue
+            ordinals.add(to_date(dt).toordinal())
+    return frozenset(ordinals)
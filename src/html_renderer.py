@@ -0,0 +1,69 @@
+from html import escape
+from string import Template
+
+# renders invoices straight to HTML, no markdown round trip, and shares one parsed
+# stylesheet between every PDF written by the process
+
+STYLESHEET = """
+table {width: 100%; border-collapse: collapse;}
+th, td {border: 1px solid black; padding: 1px; text-align: left;}
+th {background-color: #f2f2f2;}
+.invoice + .invoice {break-before: page;}
+"""
+
+DOCUMENT_TEMPLATE = Template("""<html>
+<head><meta charset="utf-8"></head>
+<body>
+$body
+</body>
+</html>""")
+
+INVOICE_TEMPLATE = Template("""<section class="invoice">
+<p>$invoice_date</p>
+$header
+<table>
+<thead>
+<tr>$columns</tr>
+</thead>
+<tbody>
+$rows
+</tbody>
+</table>
+<p>$total_hours</p>
+<p>$total_amount</p>
+</section>""")
+
+_stylesheet = None
+
+
+def get_stylesheet():
+    # parsed once per process
+    global _stylesheet
+    if _stylesheet is None:
+        # weasyprint is slow to import, only pay for it when a PDF is written
+        from weasyprint import CSS
+        _stylesheet = CSS(string=STYLESHEET)
+    return _stylesheet
+
+
+def render_invoice_body(invoice_date, header_fields, columns, rows, total_hours, total_amount):
+    return INVOICE_TEMPLATE.substitute(
+        invoice_date=escape(invoice_date),
+        header='\n'.join(f'<h3>{escape(label)}: {escape(str(value))}</h3>' for label, value in header_fields),
+        columns=''.join(f'<th>{escape(column)}</th>' for column in columns),
+        rows='\n'.join('<tr>' + ''.join(f'<td>{escape(value)}</td>' for value in row) + '</tr>' for row in rows),
+        total_hours=escape(total_hours),
+        total_amount=escape(total_amount),
+    )
+
+
+def render_document(bodies):
+    # several invoice bodies in one document get a page each
+    return DOCUMENT_TEMPLATE.substitute(body='\n'.join(bodies))
+
+
+def write_pdf(html_string, target=None):
+    # without a target the PDF is returned as bytes
+    from weasyprint import HTML
+    pdf = HTML(string=html_string).write_pdf(target, stylesheets=[get_stylesheet()])
+    return target if target is not None else pdf
@@ -1,18 +1,58 @@
-from icalendar import Calendar, Event
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 import json
+import re
+from bisect import bisect_left
+from event_record import EventRecord
+from recurrence import SUPPORTED_FREQS, expand_occurrences
+from parse_cache import ParseCache
+from instrumentation import Instrumentation
+from calendar_sources import is_url, load_sources, merge_events
+from overlap_detector import Occurrence, detect_overlaps
+from sharding import shard_clients
 
 import logging
 
+# name and parameters of a content line up to the colon that starts its value,
+# colons inside quoted parameter values (ALTREP="http://...") do not count
+CONTENT_LINE_NAME = re.compile(rb'[^:"]*(?:"[^"]*"[^:"]*)*:')
+
 class IcalParser:
     def __init__(self,  ical_path="BI.ics", 
                         client_list_path="src/client_data/client_list_and_info.json",
                         month=None,
                         logger=None,
-                        logger_level=logging.DEBUG
+                        logger_level=logging.DEBUG,
+                        stream=False,
+                        cache_dir=None,
+                        month_range=None,
+                        instrumentation=None,
+                        source_cache_dir='.cache/sources',
+                        shard=None
                         ):
+        # ical_path: one .ics path/url or a list of them, merged into one event set
         self.ical_path = ical_path
+        self.ical_sources = list(ical_path) if isinstance(ical_path, (list, tuple)) else [ical_path]
+        self.source_cache_dir = source_cache_dir
         self.client_list_path = client_list_path
+        # stream: read the .ics incrementally and only keep relevant VEVENTs
+        self.stream = stream
+
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+            self.logger.setLevel(logger_level)
+            if not self.logger.handlers:  # Avoid adding duplicate handlers
+                handler = logging.StreamHandler()
+                formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+                handler.setFormatter(formatter)
+                self.logger.addHandler(handler)
+            self.logger.propagate = False  # Disable propagation to the root logger
+        else:
+            self.logger = logger
+
+        self.instrumentation = instrumentation or Instrumentation()
+
+        # cache_dir: keep the parsed events on disk between runs
+        self.parse_cache = ParseCache(cache_dir, logger=self.logger) if cache_dir else None
 
         # datetime objects
         self.year = date.today().year
@@ -27,36 +67,184 @@ class IcalParser:
 
         self.inv_date = date(self.year, self.month,1)
 
+        # month_range: ((year, month), (year, month)) inclusive, loaded once for batch runs
+        if month_range:
+            self.year, self.month = month_range[0]
+            self.inv_date = date(self.year, self.month,1)
+        self.month_range = month_range or ((self.year, self.month), (self.year, self.month))
+
         # load object data
-        self.cal = self.load_ical()
         self.client_data = self.load_client_dict()
-        self.cal = self.filter_master_calendar()
-
-        if logger is None:
-            self.logger = logging.getLogger(__name__)
-            self.logger.setLevel(logger_level)
-            if not self.logger.handlers:  # Avoid adding duplicate handlers
-                handler = logging.StreamHandler()
-                formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-                handler.setFormatter(formatter)
-                self.logger.addHandler(handler)
-            self.logger.propagate = False  # Disable propagation to the root logger
-        else:
-            self.logger = logger
+        # shard: (i, N), only the shard's clients are kept so the other clients' events are never parsed
+        self.shard = shard
+        if shard:
+            self.client_data = shard_clients(self.client_data, *shard)
+        self.client_trie = self.build_client_trie()
+        with self.instrumentation.stage('parse') as record:
+            self.events = self.load_events()
+            record['count'] = len(self.events)
+        with self.instrumentation.stage('index') as record:
+            self.client_index = self.build_client_index()
+            record['count'] = len(self.client_index)
+
+        # duplicate / overlap / same-day findings per client, filled by calculate_hours_and_dates
+        self.overlap_findings = {}
 
         return
 
-    def load_ical(self):
-        event_cal = Calendar()
+    def load_ical(self, ical_path):
+        # yields the VEVENT components of the .ics
+        if self.stream:
+            yield from self.stream_ical(ical_path)
+            return
+
+        # icalendar is only imported when a file really has to be parsed (not on cache hits)
+        from icalendar import Calendar
 
-        with open(self.ical_path, 'rb') as f:
+        with open(ical_path, 'rb') as f:
             cal = Calendar.from_ical(f.read())
 
-            for component in cal.walk():
-                if component.name == "VEVENT":
-                    event_cal.add_component(component)
+        for component in cal.walk():
+            if component.name == "VEVENT":
+                yield component
+
+    def load_events(self):
+        if len(self.ical_sources) == 1 and not is_url(self.ical_sources[0]):
+            event_lists = [self.load_source_events(self.ical_sources[0])]
+        else:
+            # downloads and parses overlap across sources
+            event_lists = load_sources(self.ical_sources, self.load_source_events, self.source_cache_dir, self.logger)
+
+        return merge_events(event_lists)
+
+    def load_source_events(self, ical_path):
+        if self.parse_cache is None:
+            return self.parse_events(ical_path)
+
+        # streamed loads only hold the loaded months, so they are cached per month range
+        (start_year, start_month), (end_year, end_month) = self.month_range
+        scope = f'stream:{start_year}-{start_month:02d}:{end_year}-{end_month:02d}' if self.stream else 'full'
+        key = self.parse_cache.make_key(ical_path, self.client_data, scope)
+        events = self.parse_cache.load(key)
+        if events is None:
+            events = self.parse_events(ical_path)
+            self.parse_cache.store(key, events)
+        return events
+
+    def parse_events(self, ical_path):
+        # normalize every VEVENT that belongs to a client into an EventRecord once,
+        # the icalendar components are dropped after this
+        events = []
+        for component in self.load_ical(ical_path):
+            if not component.get('dtstart'):
+                continue
+            for client_id in self.match_clients(str(component.get('summary'))):
+                events.append(EventRecord.from_component(component, client_id))
+
+        return events
 
-        return event_cal
+    def set_invoice_period(self, year, month):
+        self.year = year
+        self.month = month
+        self.inv_date = date(self.year, self.month,1)
+
+    def get_invoice_window(self):
+        # first day of the invoice month and first day of the following month
+        return month_window(self.year, self.month)
+
+    def get_load_window(self):
+        # first day of the first month of the range and first day after the last month
+        (start_year, start_month), (end_year, end_month) = self.month_range
+        return month_window(start_year, start_month)[0], month_window(end_year, end_month)[1]
+
+    def iter_months(self):
+        (year, month), end = self.month_range
+        while (year, month) <= end:
+            yield year, month
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    def stream_ical(self, ical_path):
+        # read the .ics line by line, only VEVENT blocks whose summary starts with a client id
+        # are handed to icalendar, everything else is dropped without being parsed
+        from icalendar import Event
+
+        window_start, window_end = self.get_load_window()
+        block = None
+
+        with open(ical_path, 'rb') as f:
+            for line in self.unfold_lines(f):
+                # names are case-insensitive, icalendar reads begin:vevent too
+                if block is None:
+                    if line.upper() == b'BEGIN:VEVENT':
+                        block = [line]
+                    continue
+
+                block.append(line)
+                if line.upper() != b'END:VEVENT':
+                    continue
+
+                summary = self.get_block_summary(block)
+                if summary is not None and self.match_clients(summary):
+                    event = Event.from_ical(b'\r\n'.join(block))
+                    if self.event_in_window(event, window_start, window_end):
+                        yield event
+                block = None
+
+    def unfold_lines(self, f):
+        # undo RFC 5545 line folding (continuation lines start with a space or tab)
+        current = None
+        for raw in f:
+            raw = raw.rstrip(b'\r\n')
+            if raw[:1] in (b' ', b'\t') and current is not None:
+                current += raw[1:]
+                continue
+            if current is not None:
+                yield current
+            current = raw
+        if current is not None:
+            yield current
+
+    def get_block_summary(self, block):
+        for line in block:
+            if line[:7].upper() == b'SUMMARY' and line[7:8] in (b':', b';'):
+                name = CONTENT_LINE_NAME.match(line)
+                if name is None:
+                    return None
+                value = line[name.end():].decode('utf-8', errors='replace')
+                return value.replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\')
+        return None
+
+    def event_in_window(self, event, window_start, window_end):
+        if not event.get('dtstart'):
+            return False
+        start_date = event.get('dtstart').dt
+        if isinstance(start_date, datetime):
+            start_date = start_date.date()
+
+        if event.get('RDATE'):
+            # extra dates can land anywhere, keep the series
+            return True
+
+        if event.get('RECURRENCE-ID'):
+            # an override also removes the occurrence it replaces, so it is needed in that month too
+            recurrence_date = event.get('RECURRENCE-ID').dt
+            if isinstance(recurrence_date, datetime):
+                recurrence_date = recurrence_date.date()
+            if window_start <= recurrence_date < window_end:
+                return True
+
+        if event.get('RRULE'):
+            # recurring events can touch the window if they started before it ends and did not end before it starts
+            if start_date >= window_end:
+                return False
+            if 'UNTIL' in event['RRULE']:
+                until = event['RRULE']['UNTIL'][0]
+                if isinstance(until, datetime):
+                    until = until.date()
+                return until >= window_start
+            return True
+
+        return window_start <= start_date < window_end
 
     def load_client_dict(self):
         with open(self.client_list_path, 'r') as f:
@@ -64,234 +252,169 @@ class IcalParser:
 
         return client_list
 
-    def filter_master_calendar(self):
-        filtered_master_cal = Calendar()
+    def build_client_trie(self):
+        # prefix trie of the client ids, the None key marks the end of a client id
+        trie = {}
+        for client_id in self.client_data:
+            node = trie
+            for char in client_id:
+                node = node.setdefault(char, {})
+            node[None] = client_id
+        return trie
+
+    def match_clients(self, summary):
+        # walk the trie along the summary, a client id only matches if the summary
+        # ends there or has a space directly after it, otherwise could be part of another name
+        matches = []
+        node = self.client_trie
+        for char in summary:
+            if char == ' ' and None in node:
+                matches.append(node[None])
+            node = node.get(char)
+            if node is None:
+                return matches
+        if None in node:
+            matches.append(node[None])
+        return matches
+
+    def build_client_index(self):
+        # one pass over the events bucketing every event by client id and type
+        client_index = {client_id: {'recurring': [], 'non_recurring': []} for client_id in self.client_data}
+
+        for event in self.events:
+            event_type = 'recurring' if event.recurring else 'non_recurring'
+            client_index[event.client_id][event_type].append(event)
+
+        # non-recurring events sorted by start so a window is a bisect range query
+        for client_events in client_index.values():
+            client_events['non_recurring'].sort(key=lambda event: event.start)
+            client_events['non_recurring_starts'] = [event.start for event in client_events['non_recurring']]
+
+        return client_index
+    
+    def filter_client_calendar(self,client_id,window=None):
+        client_events = self.client_index.get(client_id, {'recurring': [], 'non_recurring': [], 'non_recurring_starts': []})
 
-        # datetime
-        exp_date = date(self.year, self.month+1, 1)
+        client_non_recurring_filtered = self.filter_non_recurring(client_events['non_recurring'],window,
+                                                                  client_events['non_recurring_starts'])
+        client_recurring_filtered = self.filter_recurring(client_events['recurring'],window)
 
-        for component in self.cal.walk():
-            if component.name == "VEVENT":
-                # # parse and simplify date objects
-                # start_date = component.get('dtstart').dt
-                # if isinstance(start_date, datetime):
-                #     start_date = start_date.date()
-                # if start_date >= exp_date:
-                    # continue
-                # parse client name and title of event
-                event_summary = str(component.get('summary'))
-                for client_id, client_info in self.client_data.items():
-                    client_id_str = client_id
-                    if event_summary.startswith(client_id_str):
-                        filtered_master_cal.add_component(component)
-                        break
-        
-
-        return filtered_master_cal
-    
-    def filter_client_calendar(self,client_id):
-        # create client_id string
-        client_id_str = client_id
+        return client_non_recurring_filtered,client_recurring_filtered
 
-        client_id_cal = Calendar()
+    def filter_recurring(self,events,window=None):
+        window_start, window_end = window or self.get_invoice_window()
+        window_start, window_end = window_start.toordinal(), window_end.toordinal()
 
-        for component in self.cal.walk():
-            if str(component.get('summary')).startswith(client_id_str):
-                # check if client_id has a space directly after it, otherwise could be part of another name
-                if len(str(component.get('summary'))) > len(client_id_str) and str(component.get('summary'))[len(client_id_str)] != ' ':
-                    continue
-                client_id_cal.add_component(component)
-
-        # separate into types
-        client_id_cal_recurring = Calendar()
-        client_id_cal_non_recurring = Calendar()
-
-        for component in client_id_cal.walk():
-            if component.get('RRULE'):
-                client_id_cal_recurring.add_component(component)
-            else:
-                client_id_cal_non_recurring.add_component(component)
-
-        client_id_cal_non_recurring_filtered = self.filter_non_recurring(client_id_cal_non_recurring)
-        client_id_cal_recurring_filtered = self.filter_recurring(client_id_cal_recurring)
-
-        return client_id_cal_non_recurring_filtered,client_id_cal_recurring_filtered
-
-    def filter_recurring(self,non_filtered_cal):
-        client_id_cal_recurring_filtered = Calendar()
-        for component in non_filtered_cal.walk():
-            if component.get('RRULE'):
-                if 'UNTIL' in component['RRULE']:
-                    if component['RRULE']['UNTIL'][0].date() >= self.inv_date.date():
-                        client_id_cal_recurring_filtered.add_component(component)
-                        self.logger.debug(f'Found:Recurring: {component.get('Summary')}')
-                else:
-                    client_id_cal_recurring_filtered.add_component(component)
-                    self.logger.debug(f'Found:Recurring: {component.get('Summary')}')
-        return client_id_cal_recurring_filtered
-
-    def filter_non_recurring(self,non_filtered_cal):
-        # go through non-recurring events and filter so that it happened in the datetime we want
-        client_id_cal_non_recurring_filtered = Calendar()
-        for component in non_filtered_cal.walk():
-            if component.get('dtstart'):
-
-                start_date = component.get('dtstart').dt
-            else:
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        client_recurring_filtered = []
+        for event in events:
+            if event.start >= window_end and not event.rdates:
                 continue
-            if isinstance(start_date, datetime):
-                start_date = start_date.date()
-            if start_date.month == self.month and start_date.year == self.year:
-                client_id_cal_non_recurring_filtered.add_component(component)
-                self.logger.debug(f'Found:NonRecurring: {component.get('Summary')}')
-        return client_id_cal_non_recurring_filtered
-
-    def get_recur_info(self,recur_cal):
-
-        recur_data = []
-        data_empty = {
-            'date': None,
-            'hours': None,
-            'parking': False
-        }
-
-        for event in recur_cal.events:
-            # get the days of the week that the event takes place on
-            if event.get('dtstart').dt > self.inv_date.astimezone()+timedelta(weeks=4):
+            if event.rrule is None or event.rrule['until'] is None or event.rrule['until'] >= window_start or event.rdates:
+                client_recurring_filtered.append(event)
+                if debug:
+                    self.logger.debug(f'Found:Recurring: {event.summary}')
+        return client_recurring_filtered
+
+    def filter_non_recurring(self,events,window=None,starts=None):
+        # go through non-recurring events and filter so that it happened in the datetime we want,
+        # starts: sorted start ordinals of events, turns the scan into a bisect range query
+        window_start, window_end = window or self.get_invoice_window()
+        window_start, window_end = window_start.toordinal(), window_end.toordinal()
+
+        if starts is not None:
+            client_non_recurring_filtered = events[bisect_left(starts, window_start):bisect_left(starts, window_end)]
+        else:
+            client_non_recurring_filtered = [event for event in events if window_start <= event.start < window_end]
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for event in client_non_recurring_filtered:
+                self.logger.debug(f'Found:NonRecurring: {event.summary}')
+        return client_non_recurring_filtered
+
+    def get_recur_info(self,recur_events,window=None):
+        # every occurrence of the recurring events in the window
+        occurrences = []
+        window_start, window_end = window or self.get_invoice_window()
+        window_start, window_end = window_start.toordinal(), window_end.toordinal()
+
+        for event in recur_events:
+            # check frequency rule
+            if event.rrule is not None and event.rrule['freq'] not in SUPPORTED_FREQS:
+                self.logger.warning(f'Unsupported Recurring Frequency {event.rrule['freq']}: {event.summary}')
                 continue
-            if 'RRULE' in event:
-                # Get day of week from start date
-                start_date = event.get('dtstart').dt
-                if isinstance(start_date, datetime):
-                    start_date = start_date.date()
-                weekday = start_date.weekday()  # Gets day number (0-6, where 0 is Monday)
-                # Get duration/hours from event
-                duration = event.get('duration')
-
-                # check frequency rule
-                interval = 1
-                if 'FREQ' in event['RRULE']:
-                    if event['RRULE']['FREQ'][0] != 'WEEKLY':
-                        self.logger.warning(f'Only Weekly Recurring Events Supported: {event.get('Summary')}')
-                        continue
-                    if 'INTERVAL' in event['RRULE']:
-                        interval = event['RRULE']['INTERVAL'][0]
-                
-                # get first event of month based on interval
-                # Find how many weeks since the first event to this month's first day
-                weeks_diff = ((date(self.inv_date.year, self.inv_date.month, 1) - start_date).days // 7)
-                # Adjust for the interval by finding how many complete intervals have passed
-                intervals_passed = weeks_diff // interval
-                # Calculate the first event of this month by adding the complete intervals
-                first_event = start_date + timedelta(weeks=intervals_passed * interval)
-                # If first_event is before the month starts, add one more interval
-                if first_event < (date(self.inv_date.year, self.inv_date.month, 1)):
-                    first_event = start_date + timedelta(weeks=(intervals_passed + 1) * interval)
-
-                # Get all occurrences in the month
-                current_date = first_event
-
-                while current_date.month == self.month:
-                    if current_date in [item['date'] for item in recur_data]:
-                        pass
-                    else:
-                        recur_data.append(data_empty.copy())
-                        recur_data[-1]['date'] = current_date   
-                        self.logger.debug(f'Added Recurring: {current_date}')
-                        if not isinstance(duration, timedelta):
-                            start_time = event.get('dtstart').dt
-                            end_time = event.get('dtend').dt
-                            duration = end_time - start_time
-                        recur_data[-1]['hours'] = (duration.seconds / 3600)  # Convert seconds to hours
-                        if self.check_parking(event):
-                            recur_data[-1]['parking'] = True
-                    current_date += timedelta(weeks=interval)
-
-                # check the exdates
-                if 'EXDATE' in event:
-                    dates = [item['date'] for item in recur_data]
-                    exdates = event['EXDATE']
-                    if not hasattr(exdates, '__iter__'):
-                        exdates = [exdates]
-                    # check exdates against dates
-                    for exdate in exdates:
-                        if exdate.dts[0].dt.date() in dates:
-                            index = dates.index(exdate.dts[0].dt.date())
-                            self.logger.debug(f'Removed:Recurring:{exdate.dts[0].dt.date()}')
-                            recur_data.pop(index)
-                            dates.pop(index)
-
-        return recur_data
-
-    def get_non_recur_info(self,non_recur_cal,recur_data_dates):
-        recur_data = []
-        data_empty = {
-            'date': None,
-            'hours': None,
-            'parking': False
-        }
-        if not isinstance(recur_data_dates, list):
-            recur_data_dates = [recur_data_dates]
-        recur_data_dates_ = [item['date'] for item in recur_data_dates]
-        all_dates = []
-
-        for event in non_recur_cal.events:
-            # get the days of the week that the event takes place on
-            if 'DTSTART' in event:
-                # Get day of week from start date
-                start_date = event.get('dtstart').dt
-                if isinstance(start_date, datetime):
-                    start_date = start_date.date()
-                # see if exists in recur_data_dates
-                if start_date in recur_data_dates_:
-                    pass
-                elif start_date in all_dates:
-                    pass
-                else:
-                    all_dates.append(start_date)
-                    recur_data.append(data_empty.copy())
-                    self.logger.debug(f'Added NonRecurring: {start_date}')
-                    recur_data[-1]['date'] = start_date
-                    if 'DTEND' in event:
-                        end_date = event.get('dtend').dt
-                        duration = end_date - event.get('dtstart').dt
-                        recur_data[-1]['hours'] = (duration.seconds / 3600)
-
-                    if self.check_parking(event):
-                        recur_data[-1]['parking'] = True
-                        continue
-                    
-                if self.check_parking(event):
-                    date_to_match = start_date
-                    for item in recur_data_dates:
-                        if item['date'] == date_to_match:
-                            item['parking'] = True
-                            break
-
-        return recur_data
-    
-    def check_parking(self,component):
-        if component.get('Summary') and 'park' in component.get('Summary').lower():
-            self.logger.debug(f'Parking Found: {component.get('Summary')}')
-            return True
-        return False
+            occurrences.extend(Occurrence(ordinal, event, True) for ordinal in expand_occurrences(event, window_start, window_end))
+
+        return occurrences
+
+    def get_non_recur_info(self,non_recur_events):
+        return [Occurrence(event.start, event, False) for event in non_recur_events]
+
+    def build_line_items(self,sessions):
+        # one line item per session, parking if any event of the session mentions it
+        data = []
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        for session in sessions:
+            primary = session.primary
+            item = {
+                'date': date.fromordinal(primary.date),
+                'hours': primary.event.duration / 3600 if primary.event.duration is not None else None,  # Convert seconds to hours
+                'parking': session.parking
+            }
+            if debug:
+                self.logger.debug(f'Added {'Recurring' if primary.recurring else 'NonRecurring'}: {item['date']}')
+                if item['parking']:
+                    self.logger.debug(f'Parking Found: {item['date']}')
+            data.append(item)
+        return data
     
     def sort_data(self,data):
         # sort data by date
         return sorted(data, key=lambda x: x['date'])
     
-    def calculate_hours_and_dates(self,client_name):
+    def calculate_hours_and_dates(self,client_name,window=None):
         self.logger.info(f'Parsing Data for {client_name}')
-        non_recur,recur = self.filter_client_calendar(client_name)
-
-        recur_data = self.get_recur_info(recur)
-        non_recur_data = self.get_non_recur_info(non_recur,recur_data)
-
-        all_data = recur_data + non_recur_data
+        # timings are keyed by the client's name, same as the invoice stages
+        label = self.client_data.get(client_name, {}).get('name', client_name)
+        with self.instrumentation.stage('filter', label) as record:
+            non_recur,recur = self.filter_client_calendar(client_name,window)
+            record['count'] = len(non_recur) + len(recur)
+
+        with self.instrumentation.stage('expand', label) as record:
+            occurrences = self.get_recur_info(recur,window) + self.get_non_recur_info(non_recur)
+            record['count'] = len(occurrences)
+        with self.instrumentation.stage('detect', label) as record:
+            # duplicates and overlapping events collapse into one session, other same-day sessions are kept
+            sessions, findings = detect_overlaps(occurrences)
+            self.overlap_findings[client_name] = findings
+            record['count'] = len(findings)
+            if findings:
+                self.logger.info(f'{len(findings)} Duplicate/Overlap/Same Day Findings for {client_name}')
+
+        all_data = self.build_line_items(sessions)
         all_data = self.sort_data(all_data)
 
         return all_data
 
+    def write_overlap_report(self, path):
+        # findings of every client processed so far
+        with open(path, 'w') as f:
+            json.dump(self.overlap_findings, f, indent=2)
+        return path
+
+    def calculate_hours_and_dates_by_month(self,client_name):
+        # expand the whole month range in one sweep and split it by month afterwards,
+        # dedup and parking merging only ever look at a single date so this matches per-month runs
+        by_month = {}
+        for item in self.calculate_hours_and_dates(client_name,self.get_load_window()):
+            by_month.setdefault((item['date'].year, item['date'].month), []).append(item)
+        return by_month
+
+
+def month_window(year, month):
+    if month == 12:
+        return date(year, 12, 1), date(year + 1, 1, 1)
+    return date(year, month, 1), date(year, month + 1, 1)
 
     
 # testing
@@ -0,0 +1,107 @@
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+class Instrumentation:
+    # records wall time, item counts and (optionally) allocated bytes per pipeline stage and client
+    def __init__(self, track_allocations=False, max_records=None):
+        self.track_allocations = track_allocations
+        # max_records: only keep the latest records, for long-running processes
+        self.records = deque(maxlen=max_records) if max_records else []
+        self.hooks = []
+        self.origin = time.perf_counter()
+
+        if track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def register_hook(self, hook):
+        # hook(record) is called after every finished stage
+        self.hooks.append(hook)
+
+    @contextmanager
+    def stage(self, name, client=None):
+        record = {'stage': name, 'client': client, 'count': None}
+        alloc_start = tracemalloc.get_traced_memory()[0] if self.track_allocations else None
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            end = time.perf_counter()
+            record['start'] = start - self.origin
+            record['wall'] = end - start
+            if alloc_start is not None:
+                record['alloc_bytes'] = tracemalloc.get_traced_memory()[0] - alloc_start
+            self.add_record(record)
+
+    def add_record(self, record):
+        # also used for stages timed elsewhere, e.g. pdf rendering in a worker process
+        record.setdefault('client', None)
+        record.setdefault('count', None)
+        record.setdefault('start', time.perf_counter() - self.origin - record['wall'])
+        record.setdefault('pid', os.getpid())
+        record.setdefault('tid', threading.get_ident())
+        self.records.append(record)
+        for hook in self.hooks:
+            hook(record)
+
+    def summary(self):
+        stages = {}
+        # a copy, other threads may still be adding records
+        for record in list(self.records):
+            stage = stages.setdefault(record['stage'], {'calls': 0, 'wall': 0.0, 'count': 0, 'alloc_bytes': 0})
+            stage['calls'] += 1
+            stage['wall'] += record['wall']
+            stage['count'] += record['count'] or 0
+            stage['alloc_bytes'] += record.get('alloc_bytes', 0)
+        return stages
+
+    def client_summary(self):
+        clients = {}
+        for record in list(self.records):
+            if record['client'] is None:
+                continue
+            stages = clients.setdefault(record['client'], {})
+            stages[record['stage']] = stages.get(record['stage'], 0.0) + record['wall']
+        return clients
+
+    def report(self):
+        return {'stages': self.summary(), 'clients': self.client_summary(), 'records': list(self.records)}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+    def write_trace(self, path):
+        # chrome://tracing / perfetto trace-event format
+        events = []
+        for record in self.records:
+            name = record['stage'] if record['client'] is None else f"{record['stage']}:{record['client']}"
+            args = {key: value for key, value in record.items() if key in ('count', 'alloc_bytes', 'client')}
+            events.append({
+                'name': name,
+                'cat': record['stage'],
+                'ph': 'X',
+                'ts': record['start'] * 1e6,
+                'dur': record['wall'] * 1e6,
+                'pid': record['pid'],
+                'tid': record['tid'],
+                'args': args,
+            })
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+    def profile(self, func, *args, path=None, **kwargs):
+        # run func under cProfile, returns (result, pstats.Stats) and dumps raw stats to path
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func, *args, **kwargs)
+        if path:
+            profiler.dump_stats(path)
+        return result, pstats.Stats(profiler)
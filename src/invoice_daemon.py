@@ -0,0 +1,276 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from InvoiceApp import InvoiceApp
+from ical_parser import IcalParser, month_window
+from calendar_sources import is_url
+from billing import BillingEngine
+from ledger import totals_row
+from html_renderer import write_pdf
+from output_writer import write_output_file
+
+# long-running service: the calendar is parsed and indexed once, the .ics and the client
+# list are polled for changes and only clients whose events changed lose their cached line items
+
+
+class UnknownClient(LookupError):
+    pass
+
+
+class InvoiceDaemon:
+    def __init__(self, ical_path="BI.ics", client_list_path="src/client_data/client_list_and_info.json",
+                 mydatafp="src/my_info/my_info.json", host='127.0.0.1', port=8765, poll_interval=2.0,
+                 cache_dir=None, logger_level=logging.INFO, max_records=10000):
+        # max_records keeps the stage timings of a long-running process bounded
+        self.app = InvoiceApp(ical_path, client_list_path, logger_level=logger_level, mydatafp=mydatafp,
+                              cache_dir=cache_dir, max_records=max_records)
+        self.logger = self.app.logger
+        self.host = host
+        self.port = port
+        self.poll_interval = poll_interval
+        # the month served when a request has no ?month=
+        self.default_period = (self.app.year, self.app.month)
+
+        # queries and reloads share the app, so both go through this lock
+        self.lock = threading.RLock()
+        self.items_cache = {}       # (client_id, year, month) -> line items
+        self.fingerprints = self.client_fingerprints(self.app.client_index, self.app.client_data)
+        self.signatures = self.watch_signatures()
+        self.loaded_at = time.time()
+        self.reloads = 0
+
+        self.stopping = threading.Event()
+        self.watcher = None
+        self.server = None
+
+    def watched_paths(self):
+        # remote sources are not polled, they are fetched again on every reload
+        return [source for source in self.app.ical_sources if not is_url(source)] + [self.app.client_list_path]
+
+    def watch_signatures(self):
+        signatures = {}
+        for path in self.watched_paths():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                signatures[path] = None
+            else:
+                signatures[path] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def client_fingerprints(self, client_index, client_data):
+        # one hash per client over its events and its client list entry
+        fingerprints = {}
+        for client_id, client_events in client_index.items():
+            digest = hashlib.sha256(json.dumps(client_data.get(client_id), sort_keys=True, default=str).encode())
+            events = client_events['recurring'] + client_events['non_recurring']
+            for fingerprint in sorted(event.fingerprint() for event in events):
+                digest.update(fingerprint.encode())
+            fingerprints[client_id] = digest.hexdigest()
+        return fingerprints
+
+    def check_for_changes(self):
+        signatures = self.watch_signatures()
+        if signatures == self.signatures:
+            return None
+        # recorded first, a half written file is picked up again by its next write
+        self.signatures = signatures
+        try:
+            return self.reload()
+        except Exception as e:
+            self.logger.error(f'Reload Failed, Keeping Previous State: {e!r}')
+            return None
+
+    def reload(self):
+        # parse into a separate parser so queries keep being answered from the old state,
+        # then swap in only the clients that changed
+        app = self.app
+        with app.instrumentation.stage('reload') as record:
+            fresh = IcalParser(app.ical_path, app.client_list_path, logger=self.logger,
+                               cache_dir=app.parse_cache.cache_dir if app.parse_cache else None,
+                               instrumentation=app.instrumentation, source_cache_dir=app.source_cache_dir)
+            fingerprints = self.client_fingerprints(fresh.client_index, fresh.client_data)
+            changed = {client_id for client_id in fingerprints.keys() | self.fingerprints.keys()
+                       if fingerprints.get(client_id) != self.fingerprints.get(client_id)}
+
+            with self.lock:
+                app.client_data = fresh.client_data
+                app.client_trie = fresh.client_trie
+                app.events = fresh.events
+                for client_id in changed:
+                    if client_id in fresh.client_index:
+                        app.client_index[client_id] = fresh.client_index[client_id]
+                    else:
+                        app.client_index.pop(client_id, None)
+                        app.overlap_findings.pop(client_id, None)
+                self.items_cache = {key: items for key, items in self.items_cache.items() if key[0] not in changed}
+                self.fingerprints = fingerprints
+                self.loaded_at = time.time()
+                self.reloads += 1
+            record['count'] = len(changed)
+
+        self.logger.info(f'Reloaded Calendar, {len(changed)} Clients Changed: {", ".join(sorted(changed))}')
+        return changed
+
+    def watch(self):
+        while not self.stopping.wait(self.poll_interval):
+            self.check_for_changes()
+
+    def clients(self):
+        with self.lock:
+            return [{'id': client_id, 'name': value['name']} for client_id, value in self.app.client_data.items()]
+
+    def client_info(self, client_id):
+        # callers hold the lock, a reload can drop the client between two requests
+        client_info = self.app.client_data.get(client_id)
+        if client_info is None:
+            raise UnknownClient(f'unknown client: {client_id}')
+        return client_info
+
+    def line_items(self, client_id, year, month):
+        key = (client_id, year, month)
+        with self.lock:
+            self.client_info(client_id)
+            items = self.items_cache.get(key)
+            if items is None:
+                items = self.app.calculate_hours_and_dates(client_id, month_window(year, month))
+                self.items_cache[key] = items
+            return items
+
+    def totals(self, client_id, year, month):
+        with self.lock:
+            items = self.line_items(client_id, year, month)
+            client_info = self.client_info(client_id)
+        engine = BillingEngine()
+        engine.add_client(client_id, client_info, items)
+        return totals_row(engine.compute().client_totals()[0])
+
+    def preview(self, client_id, year, month):
+        with self.lock:
+            items = self.line_items(client_id, year, month)
+            self.app.set_invoice_period(year, month)
+            markdown_file, _ = self.app.build_invoice_body(self.client_info(client_id), items)
+        return markdown_file
+
+    def render(self, client_id, year, month):
+        # writes the markdown and PDF like a batch run and returns the PDF bytes,
+        # the PDF itself is rendered outside the lock
+        with self.lock:
+            items = self.line_items(client_id, year, month)
+            self.app.set_invoice_period(year, month)
+            client_info = self.client_info(client_id)
+            markdown_file, markdown_path, full_html_string, pdf_path = self.app.build_invoice(client_info, items)
+        with self.app.instrumentation.stage('pdf', client_info['name']):
+            pdf = write_pdf(full_html_string)
+        write_output_file(markdown_path, markdown_file)
+        write_output_file(pdf_path, pdf)
+        return pdf
+
+    def status(self):
+        with self.lock:
+            return {
+                'clients': len(self.app.client_data),
+                'events': len(self.app.events),
+                'cached_items': len(self.items_cache),
+                'loaded_at': self.loaded_at,
+                'reloads': self.reloads,
+                'stages': self.app.instrumentation.summary(),
+            }
+
+    def serve(self):
+        self.watcher = threading.Thread(target=self.watch, name='ical-watcher', daemon=True)
+        self.watcher.start()
+        self.server = ThreadingHTTPServer((self.host, self.port), InvoiceRequestHandler)
+        self.server.invoice_daemon = self
+        self.logger.warning(f'Serving Invoices on http://{self.host}:{self.server.server_port}')
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stopping.set()
+            self.server.server_close()
+
+    def shutdown(self):
+        self.stopping.set()
+        if self.server is not None:
+            self.server.shutdown()
+
+
+def parse_period(query, default):
+    # ?month=YYYY-MM
+    value = query.get('month', [None])[0]
+    if value is None:
+        return default
+    try:
+        year, month = (int(part) for part in value.split('-'))
+    except ValueError:
+        raise ValueError(f'invalid month: {value!r} (expected YYYY-MM)')
+    if not 1 <= month <= 12:
+        raise ValueError(f'invalid month: {value!r} (expected YYYY-MM)')
+    return year, month
+
+
+class InvoiceRequestHandler(BaseHTTPRequestHandler):
+    # GET /status
+    # GET /clients
+    # GET /clients/<id>/items?month=YYYY-MM
+    # GET /clients/<id>/totals?month=YYYY-MM
+    # GET /clients/<id>/preview?month=YYYY-MM   invoice markdown
+    # GET /clients/<id>/invoice.pdf?month=YYYY-MM   renders and returns the PDF
+
+    def do_GET(self):
+        daemon = self.server.invoice_daemon
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/') if part]
+
+        try:
+            if parts == ['status']:
+                return self.send_json(daemon.status())
+            if parts == ['clients']:
+                return self.send_json(daemon.clients())
+            if len(parts) != 3 or parts[0] != 'clients':
+                return self.send_json({'error': f'not found: {url.path}'}, 404)
+
+            client_id, action = parts[1], parts[2]
+            year, month = parse_period(parse_qs(url.query), daemon.default_period)
+
+            if action == 'items':
+                items = daemon.line_items(client_id, year, month)
+                return self.send_json({
+                    'client': client_id,
+                    'month': f'{year}-{month:02d}',
+                    'items': [{'date': item['date'].isoformat(), 'hours': item['hours'], 'parking': item['parking']}
+                              for item in items],
+                })
+            if action == 'totals':
+                return self.send_json(dict(daemon.totals(client_id, year, month), month=f'{year}-{month:02d}'))
+            if action == 'preview':
+                return self.send_body(daemon.preview(client_id, year, month).encode(), 'text/markdown; charset=utf-8')
+            if action == 'invoice.pdf':
+                return self.send_body(daemon.render(client_id, year, month), 'application/pdf')
+            return self.send_json({'error': f'not found: {url.path}'}, 404)
+        except UnknownClient as e:
+            return self.send_json({'error': str(e)}, 404)
+        except ValueError as e:
+            return self.send_json({'error': str(e)}, 400)
+        except Exception as e:
+            daemon.logger.error(f'Request Failed {self.path}: {e!r}')
+            return self.send_json({'error': repr(e)}, 500)
+
+    def send_json(self, payload, status=200):
+        self.send_body(json.dumps(payload, default=str).encode(), 'application/json', status)
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.invoice_daemon.logger.debug(f'{self.address_string()} {format % args}')
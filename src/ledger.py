@@ -0,0 +1,140 @@
+from datetime import date
+import logging
+import os
+import sqlite3
+
+from billing import format_cents
+
+# every billed line item of every run in one sqlite file, so totals across months
+# are a query instead of re-parsing the calendar once per month
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS line_items (
+    client_id TEXT NOT NULL,
+    client_name TEXT NOT NULL,
+    period TEXT NOT NULL,           -- invoice month, YYYY-MM
+    date TEXT NOT NULL,             -- YYYY-MM-DD
+    seq INTEGER NOT NULL,           -- position on the invoice
+    seconds INTEGER NOT NULL,
+    rate_cents INTEGER NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    travel_cents INTEGER NOT NULL,
+    parking_cents INTEGER NOT NULL,
+    total_cents INTEGER NOT NULL,
+    PRIMARY KEY (client_id, period, seq)
+);
+CREATE INDEX IF NOT EXISTS line_items_client_date ON line_items (client_id, date);
+CREATE INDEX IF NOT EXISTS line_items_period ON line_items (period);
+CREATE INDEX IF NOT EXISTS line_items_date ON line_items (date);
+"""
+
+TOTALS = """
+    COUNT(*) AS sessions,
+    SUM(seconds) AS seconds,
+    SUM(amount_cents) AS amount_cents,
+    SUM(travel_cents) AS travel_cents,
+    SUM(parking_cents) AS parking_cents,
+    SUM(total_cents) AS total_cents
+"""
+
+
+class Ledger:
+    def __init__(self, path='output/ledger.sqlite3', logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f'{path} has ledger schema {version}, newer than {SCHEMA_VERSION}')
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self):
+        self.conn.close()
+
+    def record_billing(self, engine, period):
+        # replaces the period's rows of every client in the (computed) BillingEngine in one transaction,
+        # a client without sessions this period ends up with no rows
+        rows = []
+        seq = [0] * len(engine.clients)
+        for index, ordinal, seconds, rate, amount, parking, total in zip(
+                engine.client_index, engine.dates, engine.seconds, engine.rate_cents,
+                engine.amount_cents, engine.parking_cents, engine.total_cents):
+            client_id, name = engine.clients[index]
+            rows.append((client_id, name, period, date.fromordinal(ordinal).isoformat(), seq[index], seconds, rate,
+                         amount, engine.travel_fee_cents, parking, total))
+            seq[index] += 1
+
+        with self.conn:
+            self.conn.executemany('DELETE FROM line_items WHERE client_id = ? AND period = ?',
+                                  [(client_id, period) for client_id, _ in engine.clients])
+            self.conn.executemany('INSERT INTO line_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.logger.info(f'Ledger: {len(rows)} Line Items for {len(engine.clients)} Clients in {period}')
+        return len(rows)
+
+    def where(self, client_id=None, start_period=None, end_period=None):
+        clauses = []
+        params = []
+        if client_id is not None:
+            clauses.append('client_id = ?')
+            params.append(client_id)
+        if start_period is not None:
+            clauses.append('period >= ?')
+            params.append(start_period)
+        if end_period is not None:
+            clauses.append('period <= ?')
+            params.append(end_period)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def client_totals(self, start_period=None, end_period=None, client_id=None):
+        # one row per client over the periods, periods are inclusive YYYY-MM
+        where, params = self.where(client_id, start_period, end_period)
+        rows = self.conn.execute(
+            f'SELECT client_id, MAX(client_name) AS name, {TOTALS} FROM line_items{where} '
+            f'GROUP BY client_id ORDER BY client_id', params)
+        return [totals_row(row) for row in rows]
+
+    def period_totals(self, start_period=None, end_period=None, client_id=None):
+        # one row per invoice month
+        where, params = self.where(client_id, start_period, end_period)
+        rows = self.conn.execute(
+            f'SELECT period, {TOTALS} FROM line_items{where} GROUP BY period ORDER BY period', params)
+        return [totals_row(row) for row in rows]
+
+    def year_to_date(self, year=None, client_id=None):
+        today = date.today()
+        year = year or today.year
+        end_period = today.strftime('%Y-%m') if year == today.year else f'{year}-12'
+        return self.client_totals(f'{year}-01', end_period, client_id)
+
+    def line_items(self, client_id, start_date=None, end_date=None):
+        # start_date inclusive, end_date exclusive
+        sql = 'SELECT * FROM line_items WHERE client_id = ?'
+        params = [client_id]
+        if start_date is not None:
+            sql += ' AND date >= ?'
+            params.append(start_date.isoformat())
+        if end_date is not None:
+            sql += ' AND date < ?'
+            params.append(end_date.isoformat())
+        return [dict(row) for row in self.conn.execute(sql + ' ORDER BY date, seq', params)]
+
+    def periods(self):
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT period FROM line_items ORDER BY period')]
+
+
+def totals_row(row):
+    totals = dict(row)
+    totals['hours'] = totals['seconds'] / 3600
+    for field in ('amount_cents', 'travel_cents', 'parking_cents', 'total_cents'):
+        totals[field.replace('_cents', '')] = format_cents(totals[field])
+    return totals
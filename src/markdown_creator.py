@@ -1,15 +1,18 @@
-# Convert markdown to HTML using markdown library
-import markdown
-from weasyprint import HTML
-from markdown.extensions.tables import TableExtension
+from html_renderer import render_invoice_body, render_document, write_pdf
+from billing import BillingEngine, format_cents
+from output_writer import OutputWriter, write_output_file
 from datetime import datetime,date
 # json
 import json
 import os
+import hashlib
+import time
 import logging
+from instrumentation import Instrumentation
 
 class MarkdownCreator():
-    def __init__(self,my_data_fp='src/my_info/my_info.json',month=None,logger=None,logger_level=logging.INFO):
+    def __init__(self,my_data_fp='src/my_info/my_info.json',month=None,logger=None,logger_level=logging.INFO,incremental=False,instrumentation=None,
+                 combined_pdf=False, archive=False):
 
         if logger is None:
             self.logger = logging.getLogger(__name__)
@@ -21,6 +24,8 @@ class MarkdownCreator():
         else:
             self.logger = logger
 
+        self.instrumentation = instrumentation or Instrumentation()
+
         # read json
         with open(my_data_fp, 'r') as f:
             self.my_data = json.load(f)
@@ -35,146 +40,216 @@ class MarkdownCreator():
             self.year = date.today().year
 
         self.inv_date = datetime(self.year, self.month, 1)
+        # artifacts are written by a background OutputWriter, started on the first write of a period
+        self.output_writer = None
+        # archive: one zip per month instead of loose markdown / pdf files
+        self.archive = archive
 
-        # Create folder for month if it doesn't exist
-        if not os.path.exists(f'output/{self.inv_date.strftime('%B').lower()}'):
-            os.makedirs(f'output/{self.inv_date.strftime('%B').lower()}')
-        
-        # create folder for markdowns
-        if not os.path.exists(f'output/{self.inv_date.strftime('%B').lower()}/markdowns'):
-            os.makedirs(f'output/{self.inv_date.strftime('%B').lower()}/markdowns')
-        
-        # create folder for pdfs
-        if not os.path.exists(f'output/{self.inv_date.strftime('%B').lower()}/pdfs'):
-            os.makedirs(f'output/{self.inv_date.strftime('%B').lower()}/pdfs')
-
-        self.invoice_entry = {
-            'Service': 'Behavour Intervention',
-            'Date': None, # datetime strf
-            'Hours': None, # string
-            'Rate': None,   # string dollar amount
-            'Travel Fee': '$3.00', # string dollar amount
-            'Parking': None,
-            'Total Fee': None, # string dollar amount,
-            'Hours float': None,
-            'Rate float': None,
-            'Total Fee float': None,
-            'Parking float': None
-
-        }
+        self.service = 'Behavour Intervention'
+        self.invoice_columns = ['Service', 'Date', 'Hours', 'Rate', 'Travel Fee', 'Parking', 'Total Fee']
         self.header = None
 
-    def create_table_header(self,invoices):
+        # incremental: skip clients whose line items did not change since the last run,
+        # a zip archive is rewritten as a whole every run so it has to contain every client
+        if incremental and archive:
+            self.logger.warning('Incremental Runs Are Not Supported With Archives .. Rendering Every Invoice')
+        self.incremental = incremental and not archive
+        self.manifest_path = f"output/{self.inv_date.strftime('%B').lower()}/manifest.json"
+        self.manifest = self.load_manifest() if self.incremental else {}
+
+        # combined_pdf: all invoices of a month go into one PDF, one page per client
+        self.combined_pdf = combined_pdf
+        self.combined_bodies = []
+
+    def set_invoice_period(self,year,month):
+        # the previous period's files are finished first
+        self.close_output()
+        self.year = year
+        self.month = month
+        self.inv_date = datetime(self.year, self.month, 1)
+
+        self.manifest_path = f"output/{self.inv_date.strftime('%B').lower()}/manifest.json"
+        self.manifest = self.load_manifest() if self.incremental else {}
+
+    def output_folder(self):
+        return f"output/{self.inv_date.strftime('%B').lower()}"
+
+    def write_output(self,path,data,archived=True):
+        if self.output_writer is None:
+            archive_path = f"{self.output_folder()}/invoices_{self.inv_date.strftime('%m_%Y')}.zip" if self.archive else None
+            self.output_writer = OutputWriter(archive_path, self.output_folder(), logger=self.logger)
+        self.output_writer.write(path,data,archived)
+
+    def close_output(self,abort=False):
+        # waits until everything queued is on disk
+        if self.output_writer is not None:
+            output_writer, self.output_writer = self.output_writer, None
+            return output_writer.close(abort)
+        return []
+
+    def create_table_header(self,parking=False):
         # don't include parking in header if no parking
-        if all(invoice['Parking float'] == 0 for invoice in invoices):
+        if not parking:
             self.logger.info('No Parking Found .. Removing Parking Column')
-            for i in invoices:
-                i.pop('Parking')
-            # self.invoice_entry.pop('Parking')
-            self.table_header = f"| {' | '.join(key for key in self.invoice_entry.keys() if 'float' not in key and key != 'Parking')} | \n"
-            # Add separator line
-            self.table_header += f"|{'|'.join([' ---------- ' for _ in range(6)])}| \n"
-            return False
-        else:
-            self.table_header = f"| {' | '.join(key for key in self.invoice_entry.keys() if 'float' not in key)} | \n"
-            # Add separator line
-            self.table_header += f"|{'|'.join([' ---------- ' for _ in range(7)])}| \n"
-            return True # parking found
+        columns = self.table_columns(parking)
+        self.table_header = f"| {' | '.join(columns)} | \n"
+        # Add separator line
+        self.table_header += f"|{'|'.join([' ---------- ' for _ in columns])}| \n"
+        return self.table_header
 
     def create_invoice_header(self,client_object):
         # create info header
-        return f"Invoice Date: {datetime.now().strftime('%B %d,%Y')}\n### Service Provider: {self.my_data['name']} \n### Mailing Address: {self.my_data['mailing_address']} \n### Phone Number: {self.my_data['phone_number']} \n### Client Name: {client_object['name']} \n### Invoice Period: {self.inv_date.strftime('%B %Y')}"
-
-    def create_table(self,objlist,parking=False):
-        table = ''
-        if parking:
-            for line in objlist:
-                # Add values
-                table += f"| {' | '.join(str(line[key]) for key in line.keys() if 'float' not in key)} | \n"
-
-        else:
-            for line in objlist:
-                # Add values
-                table += f"| {' | '.join(str(line[key]) for key in line.keys() if 'float' not in key and 'Parking' not in key)} | \n"
-
-        return table
-    
-    def fill_table(self,invoice_dict,client_dict):
-        objlist = []
-        for i in range(len(invoice_dict)):
-            entry = self.invoice_entry.copy()
-            entry['Date'] = invoice_dict[i]['date'].strftime('%B %d, %Y')
-            entry['Hours float'] = invoice_dict[i]['hours']
-            entry['Rate float'] = client_dict['rate']
-            entry['Hours'] = f"{invoice_dict[i]['hours']:.2f}"
-            entry['Rate'] = f"${client_dict['rate']:.2f}"
-
-            if invoice_dict[i]['parking']:
-                entry['Parking'] = f"${client_dict['parking rate']:.2f}"
-                entry['Parking float'] = client_dict['parking rate']
-            else:
-                entry['Parking'] = f"-"
-                entry['Parking float'] = 0
-            entry['Total Fee float'] = entry['Hours float'] * entry['Rate float'] + 3 + entry['Parking float']
-            entry['Total Fee'] = f"${entry['Total Fee float']:.2f}"
-            objlist.append(entry)
-
-        return objlist
-    
-    def create_invoice(self,client_object,inv_object):
+        return self.invoice_date_line() + "\n" + " \n".join(f"### {label}: {value}" for label, value in self.invoice_header_fields(client_object))
+
+    def invoice_date_line(self):
+        return f"Invoice Date: {datetime.now().strftime('%B %d,%Y')}"
+
+    def invoice_header_fields(self,client_object):
+        return [
+            ('Service Provider', self.my_data['name']),
+            ('Mailing Address', self.my_data['mailing_address']),
+            ('Phone Number', self.my_data['phone_number']),
+            ('Client Name', client_object['name']),
+            ('Invoice Period', self.inv_date.strftime('%B %Y')),
+        ]
+
+    def table_columns(self,parking=False):
+        return [column for column in self.invoice_columns if parking or column != 'Parking']
+
+    def bill_client(self,client_object,inv_object):
+        # the invoice shows the billing engine's columns, same money math as the CSV, ledger and shard totals
+        engine = BillingEngine()
+        index = engine.add_client(client_object['name'], client_object, inv_object)
+        return engine.compute(), index
+
+    def table_rows(self,engine,index,parking=False):
+        travel = format_cents(engine.travel_fee_cents)
+        rows = []
+        for ordinal, seconds, rate, amount, parking_cents, total in engine.rows(index):
+            row = [self.service, date.fromordinal(ordinal).strftime('%B %d, %Y'), f"{seconds / 3600:.2f}", format_cents(rate), travel]
+            if parking:
+                row.append(format_cents(parking_cents) if parking_cents else '-')
+            row.append(format_cents(total))
+            rows.append(row)
+        return rows
+
+    def create_table(self,engine,index,parking=False):
+        # Add values
+        return ''.join(f"| {' | '.join(row)} | \n" for row in self.table_rows(engine,index,parking))
+
+    def build_invoice_body(self,client_object,inv_object):
         # Invoice Header
         header = self.create_invoice_header(client_object)
-        # Invoice Table
-        invoice_object_list = self.fill_table(inv_object,client_object)
-        parking_ret = self.create_table_header(invoice_object_list)
-        table = self.create_table(invoice_object_list,parking_ret)
-        table = self.table_header+table
+        with self.instrumentation.stage('table', client_object['name']) as record:
+            # Invoice Table
+            engine, index = self.bill_client(client_object,inv_object)
+            totals = engine.client_totals()[index]
+            parking_ret = totals['parking_cents'] > 0
+            rows = self.table_rows(engine,index,parking_ret)
+            table = self.create_table_header(parking_ret) + ''.join(f"| {' | '.join(row)} | \n" for row in rows)
+            record['count'] = len(rows)
         # totals
-        total_hours = f"Total Hours: {sum(float(invoice['Hours float']) for invoice in invoice_object_list)} hours"
-        total_amount = f"Final Invoice Amount: ${sum(float(invoice['Total Fee float']) for invoice in invoice_object_list):.2f}"
+        total_hours = f"Total Hours: {sum(seconds / 3600 for seconds in engine.seconds)} hours"
+        total_amount = f"Final Invoice Amount: {format_cents(totals['total_cents'])}"
         
-        # Convert markdown to HTML
-        html = markdown.markdown(table,extensions=[TableExtension()])
-
-        # add header
-        header_html = markdown.markdown(header)
-        hours_html = markdown.markdown(total_hours)
-        amount_html = markdown.markdown(total_amount)
-
-        # put it all together
-        myhtml = header_html + html + hours_html + amount_html
-        full_html_string = self.create_html(myhtml)
+        with self.instrumentation.stage('markdown', client_object['name']):
+            # html is rendered from the same rows, not converted from the markdown
+            body = render_invoice_body(self.invoice_date_line(), self.invoice_header_fields(client_object),
+                                       self.table_columns(parking_ret), rows, total_hours, total_amount)
 
         # markdown file
         markdown_file = header + "\n\n" + table + "\n\n" + total_hours + "\n\n" + total_amount
-        # create md file with month and year in filename
-        with open(f"output/{self.inv_date.strftime('%B').lower()}/markdowns/{client_object['name']}_{self.inv_date.strftime('%m_%Y')}.md", "w") as file:
-            file.write(markdown_file)
+        return markdown_file, body
+
+    def build_invoice(self,client_object,inv_object):
+        markdown_file, body = self.build_invoice_body(client_object,inv_object)
+        full_html_string = render_document([body])
+
+        # create md and pdf files with month and year in filename
+        markdown_path, pdf_path = self.invoice_paths(client_object)
 
-        # Convert HTML to PDF using WeasyPrint
-        pdf_file = f"output/{self.inv_date.strftime('%B').lower()}/pdfs/{client_object['name']}_{self.inv_date.strftime('%m_%Y')}.pdf"
-        HTML(string=full_html_string).write_pdf(pdf_file)
+        return markdown_file, markdown_path, full_html_string, pdf_path
+
+    def create_invoice(self,client_object,inv_object):
+        if self.combined_pdf:
+            # every client is needed for the combined document, see write_combined_pdf
+            markdown_file, body = self.build_invoice_body(client_object,inv_object)
+            self.write_output(self.invoice_paths(client_object)[0], markdown_file)
+            self.combined_bodies.append(body)
+            return
+
+        if self.incremental:
+            inv_hash = self.invoice_hash(client_object,inv_object)
+            if self.invoice_is_current(client_object,inv_hash):
+                self.logger.info(f'Unchanged Invoice for {client_object['name']} .. Skipping')
+                return
+
+        markdown_file, markdown_path, full_html_string, pdf_path = self.build_invoice(client_object,inv_object)
+        with self.instrumentation.stage('pdf', client_object['name']):
+            pdf = write_pdf(full_html_string)
+        self.write_output(markdown_path, markdown_file)
+        self.write_output(pdf_path, pdf)
+
+        if self.incremental:
+            self.update_manifest(client_object,inv_hash)
 
         logging.info(f'Finished Invoice for {client_object['name']}')
 
-    def create_html(self,my_data_html_string):
-        # Create HTML string with styles
-        html_string = f"""
-        <html>
-        <head>
-            <style>
-                table {{width: 100%; border-collapse: collapse;}}
-                th, td {{border: 1px solid black; padding: 1px; text-align: left;}}
-                th {{background-color: #f2f2f2;}}
-            </style>
-        </head>
-        <body>
-            {my_data_html_string}
-        </body>
-        </html>"""
-
-        return html_string
-    
+    def invoice_hash(self,client_object,inv_object):
+        # everything that ends up on the invoice except the invoice date
+        items = [[item['date'].isoformat(), item['hours'], item['parking']] for item in inv_object]
+        payload = json.dumps([items, client_object, self.my_data, self.inv_date.strftime('%Y-%m')], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def invoice_paths(self,client_object):
+        markdown_path = f"output/{self.inv_date.strftime('%B').lower()}/markdowns/{client_object['name']}_{self.inv_date.strftime('%m_%Y')}.md"
+        pdf_path = f"output/{self.inv_date.strftime('%B').lower()}/pdfs/{client_object['name']}_{self.inv_date.strftime('%m_%Y')}.pdf"
+        return markdown_path, pdf_path
+
+    def invoice_is_current(self,client_object,inv_hash):
+        if self.manifest.get(client_object['name']) != inv_hash:
+            return False
+        # re-render if an output was deleted by hand
+        return all(os.path.exists(path) for path in self.invoice_paths(client_object))
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def update_manifest(self,client_object,inv_hash):
+        self.manifest[client_object['name']] = inv_hash
+        # queued after the invoice's files, so it is only written once they are, and kept out of the archive
+        self.write_output(self.manifest_path, json.dumps(self.manifest, indent=2, sort_keys=True), archived=False)
+
+    def write_combined_pdf(self):
+        # all collected invoices in a single layout pass
+        pdf_path = f"output/{self.inv_date.strftime('%B').lower()}/pdfs/invoices_{self.inv_date.strftime('%m_%Y')}.pdf"
+        with self.instrumentation.stage('pdf') as record:
+            pdf = write_pdf(render_document(self.combined_bodies))
+            record['count'] = len(self.combined_bodies)
+        self.write_output(pdf_path, pdf)
+        self.combined_bodies = []
+
+        logging.info(f'Finished Combined Invoice {pdf_path}')
+        return pdf_path
+
+
+def write_invoice_files(markdown_file, markdown_path, full_html_string, pdf_path):
+    # synchronous version for single invoices, runs use the OutputWriter
+    write_output_file(markdown_path, markdown_file)
+    write_output_file(pdf_path, write_pdf(full_html_string))
+    return pdf_path
+
+
+def timed_render_pdf(full_html_string):
+    # runs in a worker process, only the PDF bytes go back, the parent writes them
+    start = time.perf_counter()
+    pdf = write_pdf(full_html_string)
+    return pdf, time.perf_counter() - start
+
 
 if __name__ == '__main__':
     markdowns = MarkdownCreator(month=2)
\ No newline at end of file
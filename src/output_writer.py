@@ -0,0 +1,120 @@
+import logging
+import os
+import queue
+import tempfile
+import threading
+import zipfile
+
+# writes the invoice artifacts on a background thread fed by a bounded queue, so rendering
+# the next invoice overlaps with the disk I/O of the last one. every file goes through a temp
+# file and os.replace, or into one zip archive that only appears once it is complete
+
+OUTPUT_QUEUE_SIZE = 8
+
+# mkstemp creates 0600 files, published files get the mode open() would have given them
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+
+
+def write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_output_file(path, data):
+    # synchronous, for single files outside of a writer
+    if isinstance(data, str):
+        data = data.encode()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, data)
+    return path
+
+
+class OutputWriter:
+    def __init__(self, archive_path=None, archive_root=None, max_pending=OUTPUT_QUEUE_SIZE, logger=None):
+        # archive_path: artifacts go into this zip instead of loose files, named relative to archive_root
+        self.logger = logger or logging.getLogger(__name__)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.created_dirs = set()
+        self.written = []
+        self.error = None
+
+        self.archive_path = archive_path
+        self.archive_root = archive_root or os.path.dirname(archive_path or '')
+        self.archive = None
+        self.archive_tmp_path = None
+        if archive_path:
+            self.ensure_dir(os.path.dirname(archive_path))
+            fd, self.archive_tmp_path = tempfile.mkstemp(dir=os.path.dirname(archive_path) or '.', suffix='.tmp')
+            os.close(fd)
+            self.archive = zipfile.ZipFile(self.archive_tmp_path, 'w', zipfile.ZIP_DEFLATED)
+
+        self.thread = threading.Thread(target=self.run, name='output-writer', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(abort=exc_type is not None)
+
+    def write(self, path, data, archived=True):
+        # blocks while max_pending writes are queued, archived=False always writes a loose file
+        if self.error is not None:
+            raise self.error
+        if isinstance(data, str):
+            data = data.encode()
+        self.queue.put((path, data, archived))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            # after a failure nothing else is written, so e.g. a manifest never outlives its invoice
+            if self.error is not None:
+                continue
+            path, data, archived = item
+            try:
+                if archived and self.archive is not None:
+                    self.archive.writestr(os.path.relpath(path, self.archive_root), data)
+                else:
+                    self.ensure_dir(os.path.dirname(path))
+                    write_atomic(path, data)
+                self.written.append(path)
+            except Exception as e:
+                self.logger.error(f'Failed Writing {path}: {e!r}')
+                self.error = e
+
+    def ensure_dir(self, folder):
+        if folder and folder not in self.created_dirs:
+            os.makedirs(folder, exist_ok=True)
+            self.created_dirs.add(folder)
+
+    def close(self, abort=False):
+        # waits for the queued writes, abort drops an unfinished archive instead of publishing it
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.archive is not None:
+            self.archive.close()
+            if abort or self.error is not None:
+                os.remove(self.archive_tmp_path)
+            else:
+                os.chmod(self.archive_tmp_path, FILE_MODE)
+                os.replace(self.archive_tmp_path, self.archive_path)
+                self.logger.info(f'Wrote {len(self.written)} Files to {self.archive_path}')
+            self.archive = None
+
+        if self.error is not None and not abort:
+            raise self.error
+        return self.written
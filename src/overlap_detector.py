@@ -0,0 +1,116 @@
+from datetime import date
+
+# sweep-line over a client's expanded occurrences: overlapping occurrences collapse into one
+# billable session, back to back or later sessions on the same day stay separate.
+# all-day, zero-length and parking one-offs are notes on that day's session, not sessions
+
+
+class Occurrence:
+    __slots__ = ('date', 'start_ts', 'end_ts', 'event', 'recurring')
+
+    def __init__(self, ordinal, event, recurring):
+        # recurring occurrences keep the series' wall-clock time of day in its timezone
+        self.date = ordinal
+        self.start_ts = event.timestamp_on(ordinal)
+        self.end_ts = self.start_ts + (event.end_ts - event.start_ts) if event.end_ts is not None else self.start_ts
+        self.event = event
+        self.recurring = recurring
+
+    @property
+    def annotation(self):
+        event = self.event
+        return not self.recurring and (event.all_day or not event.duration or event.parking)
+
+
+def rank(occurrence):
+    # the occurrence a session bills: recurring first, then the longest
+    return occurrence.recurring, occurrence.event.duration or 0
+
+
+class Session:
+    __slots__ = ('primary', 'members', 'notes', 'end_ts')
+
+    def __init__(self, primary):
+        self.primary = primary
+        self.members = [primary]
+        self.notes = []
+        self.end_ts = primary.end_ts
+
+    def add(self, occurrence):
+        self.members.append(occurrence)
+        self.end_ts = max(self.end_ts, occurrence.end_ts)
+        if rank(occurrence) > rank(self.primary):
+            self.primary = occurrence
+
+    @property
+    def parking(self):
+        return any(member.event.parking for member in self.members + self.notes)
+
+
+def finding(kind, session, occurrence):
+    return {
+        'type': kind,
+        'date': date.fromordinal(session.primary.date).isoformat(),
+        'kept': session.primary.event.summary,
+        'kept_uid': session.primary.event.uid,
+        'other': occurrence.event.summary,
+        'other_uid': occurrence.event.uid,
+        'start_ts': occurrence.start_ts,
+        'end_ts': occurrence.end_ts,
+    }
+
+
+def sweep(occurrences, findings):
+    # at the same start a recurring occurrence is kept over a one-off event, then the longer one
+    ordered = sorted(occurrences, key=lambda occ: (occ.start_ts, not occ.recurring, -occ.end_ts))
+
+    sessions = []
+    current = None
+    for occurrence in ordered:
+        if current is not None:
+            primary = current.primary
+            if occurrence.start_ts == primary.start_ts and occurrence.end_ts == primary.end_ts:
+                current.add(occurrence)
+                findings.append(finding('duplicate', current, occurrence))
+                continue
+            if occurrence.start_ts < current.end_ts or occurrence.start_ts == primary.start_ts:
+                current.add(occurrence)
+                findings.append(finding('overlap', current, occurrence))
+                continue
+
+        session = Session(occurrence)
+        if current is not None and current.primary.date == occurrence.date:
+            findings.append(finding('same_day', current, occurrence))
+        sessions.append(session)
+        current = session
+
+    return sessions
+
+
+def detect_overlaps(occurrences):
+    # returns (sessions, findings) in O(n log n), findings classify every occurrence that
+    # is not a plain single session: 'duplicate', 'overlap', 'same_day' or 'annotation'
+    findings = []
+    sessions = sweep([occ for occ in occurrences if not occ.annotation], findings)
+
+    by_date = {}
+    for session in sessions:
+        by_date.setdefault(session.primary.date, []).append(session)
+
+    # a note goes to the session it overlaps, otherwise the day's first session,
+    # notes on a day without a session are billed like before
+    unattached = []
+    for occurrence in sorted((occ for occ in occurrences if occ.annotation), key=lambda occ: occ.start_ts):
+        day_sessions = by_date.get(occurrence.date)
+        if not day_sessions:
+            unattached.append(occurrence)
+            continue
+        session = next((session for session in day_sessions
+                        if occurrence.start_ts < session.end_ts and session.members[0].start_ts < occurrence.end_ts),
+                       day_sessions[0])
+        session.notes.append(occurrence)
+        findings.append(finding('annotation', session, occurrence))
+
+    if unattached:
+        sessions = sorted(sessions + sweep(unattached, findings), key=lambda session: session.primary.start_ts)
+    return sessions, findings
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+# bump when EventRecord or the parsing rules change so old entries are ignored
+CACHE_VERSION = 3
+
+
+class ParseCache:
+    def __init__(self, cache_dir='.cache/parse', max_entries=16, max_bytes=256 * 1024 * 1024, logger=None):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.logger = logger or logging.getLogger(__name__)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, ical_path, client_data, scope='full'):
+        # fingerprint of the .ics (path, size, mtime, content) and the client ids
+        stat = os.stat(ical_path)
+        content_hash = hashlib.sha256()
+        with open(ical_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                content_hash.update(chunk)
+
+        # only the ids decide which events are kept, rates can change without a reparse
+        client_hash = hashlib.sha256(json.dumps(sorted(client_data)).encode()).hexdigest()
+
+        key = hashlib.sha256()
+        for part in (CACHE_VERSION, os.path.abspath(ical_path), stat.st_size, stat.st_mtime_ns,
+                     content_hash.hexdigest(), client_hash, scope):
+            key.update(str(part).encode())
+            key.update(b'\0')
+        return key.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.pickle')
+
+    def load(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                events = pickle.load(f)
+        except FileNotFoundError:
+            self.logger.debug(f'Parse Cache Miss: {key[:12]}')
+            return None
+        except Exception as e:
+            # corrupt or incompatible entry, drop it and reparse
+            self.logger.warning(f'Parse Cache Entry Unreadable, Removing: {e!r}')
+            self.remove(path)
+            return None
+
+        # mark as recently used for eviction
+        os.utime(path)
+        self.logger.debug(f'Parse Cache Hit: {key[:12]}')
+        return events
+
+    def store(self, key, events):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(events, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.entry_path(key))
+        except BaseException:
+            self.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        # least recently used entries go first once either bound is exceeded
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pickle'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(reverse=True)
+
+        total_bytes = 0
+        for i, (mtime, size, path) in enumerate(entries):
+            total_bytes += size
+            if i >= self.max_entries or total_bytes > self.max_bytes:
+                self.logger.debug(f'Parse Cache Evicted: {os.path.basename(path)}')
+                self.remove(path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,173 @@
+from datetime import date
+import calendar
+
+# recurrence expansion on date ordinals, every function only walks the requested
+# [window_start, window_end) window instead of the whole history of a series
+
+SUPPORTED_FREQS = ('DAILY', 'WEEKLY', 'MONTHLY')
+WEEKDAYS = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+
+
+def parse_byday(byday):
+    # '2TU' -> (2, 1), 'MO' -> (None, 0), '-1FR' -> (-1, 4)
+    parsed = []
+    for day in byday:
+        day = day.upper()
+        nth = day[:-2]
+        parsed.append((int(nth) if nth not in ('', '+') else None, WEEKDAYS[day[-2:]]))
+    return parsed
+
+
+def expand_occurrences(event, window_start, window_end):
+    # returns the sorted date ordinals of event that fall in [window_start, window_end)
+    occurrences = set()
+    rrule = event.rrule
+
+    if rrule is None:
+        # rdate only series, dtstart is always the first occurrence
+        if window_start <= event.start < window_end:
+            occurrences.add(event.start)
+    else:
+        end = window_end
+        if rrule['until'] is not None:
+            end = min(end, rrule['until'] + 1)
+        if event.start < end:
+            freq = rrule['freq']
+            if freq == 'DAILY':
+                occurrences.update(expand_daily(event.start, rrule, window_start, end))
+            elif freq == 'WEEKLY':
+                occurrences.update(expand_weekly(event.start, rrule, window_start, end))
+            elif freq == 'MONTHLY':
+                occurrences.update(expand_monthly(event.start, rrule, window_start, end))
+
+    occurrences.update(ordinal for ordinal in event.rdates if window_start <= ordinal < window_end)
+    occurrences.difference_update(event.exdates)
+
+    return sorted(occurrences)
+
+
+def expand_daily(start, rrule, window_start, window_end):
+    interval = rrule['interval']
+    if rrule['byday']:
+        # daily with a weekday filter is a weekly pattern when every day is a candidate
+        if interval == 1:
+            return expand_weekly(start, rrule, window_start, window_end)
+        weekdays = {weekday for _, weekday in parse_byday(rrule['byday'])}
+        return filter_count(
+            (ordinal for ordinal in range(start, window_end, interval) if date.fromordinal(ordinal).weekday() in weekdays),
+            rrule['count'], window_start)
+
+    first = max(0, -(-(window_start - start) // interval))
+    last = -(-(window_end - start) // interval)
+    if rrule['count'] is not None:
+        last = min(last, rrule['count'])
+    return range(start + first * interval, start + last * interval, interval)
+
+
+def expand_weekly(start, rrule, window_start, window_end):
+    interval = rrule['interval']
+    if rrule['byday']:
+        weekdays = sorted({weekday for _, weekday in parse_byday(rrule['byday'])})
+    else:
+        weekdays = [date.fromordinal(start).weekday()]
+
+    # weeks start on monday (WKST=MO), block k covers the interval*k-th week after dtstart's week
+    monday = start - date.fromordinal(start).weekday()
+    per_block = len(weekdays)
+    # occurrences of the first block that are on or after dtstart
+    first_block = sum(1 for weekday in weekdays if monday + weekday >= start)
+    count = rrule['count']
+
+    block = max(0, (window_start - monday) // (7 * interval))
+    occurrences = []
+    while True:
+        block_start = monday + block * 7 * interval
+        if block_start >= window_end:
+            break
+        for position, weekday in enumerate(weekdays):
+            ordinal = block_start + weekday
+            if ordinal < start or ordinal < window_start or ordinal >= window_end:
+                continue
+            if count is not None:
+                if block == 0:
+                    index = position - (per_block - first_block)
+                else:
+                    index = first_block + (block - 1) * per_block + position
+                if index >= count:
+                    return occurrences
+            occurrences.append(ordinal)
+        block += 1
+
+    return occurrences
+
+
+def month_days(year, month, start_date, rrule):
+    # candidate days of one month, sorted
+    days_in_month = calendar.monthrange(year, month)[1]
+    days = set()
+
+    if rrule['bymonthday']:
+        for day in rrule['bymonthday']:
+            if day < 0:
+                day = days_in_month + day + 1
+            if 1 <= day <= days_in_month:
+                days.add(day)
+    elif rrule['byday']:
+        first_weekday = date(year, month, 1).weekday()
+        for nth, weekday in parse_byday(rrule['byday']):
+            matches = list(range(1 + (weekday - first_weekday) % 7, days_in_month + 1, 7))
+            if nth is None:
+                days.update(matches)
+            elif -len(matches) <= nth <= len(matches) and nth != 0:
+                days.add(matches[nth - 1] if nth > 0 else matches[nth])
+    elif start_date.day <= days_in_month:
+        # months without dtstart's day are skipped
+        days.add(start_date.day)
+
+    return [date(year, month, day).toordinal() for day in sorted(days)]
+
+
+def expand_monthly(start, rrule, window_start, window_end):
+    interval = rrule['interval']
+    count = rrule['count']
+    start_date = date.fromordinal(start)
+    start_month = start_date.year * 12 + start_date.month - 1
+
+    if count is None:
+        # jump straight to the first interval month that can touch the window
+        window_date = date.fromordinal(max(start, window_start))
+        months = window_date.year * 12 + window_date.month - 1 - start_month
+        month_index = start_month + (months // interval) * interval
+    else:
+        # counting needs every month since dtstart, one step per month is still cheap
+        month_index = start_month
+
+    occurrences = []
+    seen = 0
+    while True:
+        year, month = divmod(month_index, 12)
+        month += 1
+        if date(year, month, 1).toordinal() >= window_end:
+            break
+        for ordinal in month_days(year, month, start_date, rrule):
+            if ordinal < start or ordinal >= window_end:
+                continue
+            if count is not None:
+                if seen >= count:
+                    return occurrences
+                seen += 1
+            if ordinal >= window_start:
+                occurrences.append(ordinal)
+        month_index += interval
+
+    return occurrences
+
+
+def filter_count(ordinals, count, window_start):
+    occurrences = []
+    for index, ordinal in enumerate(ordinals):
+        if count is not None and index >= count:
+            break
+        if ordinal >= window_start:
+            occurrences.append(ordinal)
+    return occurrences
@@ -0,0 +1,118 @@
+from datetime import datetime
+import hashlib
+import json
+import os
+import socket
+
+from output_writer import write_atomic
+
+# splits the clients of a run across N machines: a client always lands on the same shard
+# (sha1 of its id), every shard writes a manifest and merge_manifests checks that together
+# they cover every client exactly once
+
+
+def parse_shard(value):
+    # 'i/N', 1 based: 1/4 .. 4/4
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f'invalid shard: {value!r} (expected i/N)')
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f'invalid shard: {value!r} (expected 1 <= i <= N)')
+    return index, count
+
+
+def shard_of(client_id, count):
+    # stable across processes and machines, unlike hash()
+    return int.from_bytes(hashlib.sha1(client_id.encode()).digest()[:8], 'big') % count + 1
+
+
+def shard_clients(client_data, index, count):
+    return {client_id: value for client_id, value in client_data.items() if shard_of(client_id, count) == index}
+
+
+def shard_manifest_path(index, count, folder='output/shards'):
+    return os.path.join(folder, f'shard-{index}-of-{count}.json')
+
+
+def write_manifest(path, manifest):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, json.dumps(manifest, indent=2, sort_keys=True, default=str).encode())
+    return path
+
+
+def build_manifest(index, count, periods, clients, errors, timings):
+    # clients: {client_id: {'name', 'periods': {YYYY-MM: {'markdown', 'pdf', totals...}}}}
+    return {
+        'shard': index,
+        'shards': count,
+        'periods': periods,
+        'clients': clients,
+        'errors': errors,
+        'timings': timings,
+        'host': socket.gethostname(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def merge_manifests(paths, client_data=None):
+    # raises ValueError listing every problem, otherwise returns the combined manifest
+    manifests = []
+    for path in paths:
+        with open(path, 'r') as f:
+            manifests.append(json.load(f))
+    if not manifests:
+        raise ValueError('no shard manifests')
+
+    problems = []
+    count = manifests[0]['shards']
+    periods = manifests[0]['periods']
+    seen_shards = {}
+    owners = {}
+    for path, manifest in zip(paths, manifests):
+        if manifest['shards'] != count:
+            problems.append(f"{path}: split into {manifest['shards']} shards, expected {count}")
+        if manifest['periods'] != periods:
+            problems.append(f"{path}: covers {manifest['periods']}, expected {periods}")
+        if manifest['shard'] in seen_shards:
+            problems.append(f"{path}: shard {manifest['shard']} already in {seen_shards[manifest['shard']]}")
+        seen_shards[manifest['shard']] = path
+        for error in manifest['errors']:
+            problems.append(f"{path}: {error['client']} failed: {error['error']}")
+
+        for client_id in manifest['clients']:
+            if client_id in owners:
+                problems.append(f"{client_id}: in {owners[client_id]} and {path}")
+            owners[client_id] = path
+            if shard_of(client_id, count) != manifest['shard']:
+                problems.append(f"{client_id}: belongs to shard {shard_of(client_id, count)}, found in shard {manifest['shard']}")
+
+    missing_shards = sorted(set(range(1, count + 1)) - seen_shards.keys())
+    if missing_shards:
+        problems.append(f"missing shards: {', '.join(f'{index}/{count}' for index in missing_shards)}")
+    if client_data is not None:
+        missing_clients = sorted(client_data.keys() - owners.keys())
+        if missing_clients:
+            problems.append(f"clients in no shard: {', '.join(missing_clients)}")
+    if problems:
+        raise ValueError('\n'.join(problems))
+
+    clients = {}
+    for manifest in manifests:
+        clients.update(manifest['clients'])
+    totals = {}
+    for client in clients.values():
+        for period, entry in client['periods'].items():
+            period_totals = totals.setdefault(period, {'sessions': 0, 'seconds': 0, 'total_cents': 0})
+            for field in period_totals:
+                period_totals[field] += entry[field]
+
+    return {
+        'shards': count,
+        'periods': periods,
+        'clients': dict(sorted(clients.items())),
+        'totals': totals,
+        'timings': {str(manifest['shard']): manifest['timings'] for manifest in manifests},
+        'hosts': {str(manifest['shard']): manifest['host'] for manifest in manifests},
+    }
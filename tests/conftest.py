@@ -0,0 +1,32 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+CLIENTS = {
+    'AA': {'name': 'Alice A', 'rate': 60, 'parking rate': 5},
+    'MLS': {'name': 'Mel S', 'rate': 50, 'parking rate': 3},
+}
+
+
+def calendar(*events):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//tests//']
+    for event in events:
+        lines += ['BEGIN:VEVENT'] + list(event) + ['END:VEVENT']
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(lines) + '\r\n').encode()
+
+
+@pytest.fixture
+def client_list(tmp_path):
+    path = tmp_path / 'clients.json'
+    path.write_text(json.dumps(CLIENTS))
+    return str(path)
+
+
+def line_items(parser, client_id):
+    return [(item['date'].isoformat(), item['hours'], item['parking'])
+            for item in parser.calculate_hours_and_dates(client_id)]
@@ -0,0 +1,96 @@
+import hashlib
+import http.server
+import logging
+import threading
+
+import pytest
+
+from calendar_sources import fetch_url
+from conftest import calendar, line_items
+from ical_parser import IcalParser
+
+SERIES = [
+    'UID:series-1',
+    'SUMMARY:AA session',
+    'DTSTART;TZID=America/Vancouver:20250303T100000',
+    'DTEND;TZID=America/Vancouver:20250303T113000',
+    'RRULE:FREQ=WEEKLY;COUNT=5',
+]
+
+ONE_OFF = [
+    'UID:one-off-1',
+    'SUMMARY:MLS',
+    'DTSTART;TZID=America/Vancouver:20250320T130000',
+    'DTEND;TZID=America/Vancouver:20250320T160000',
+]
+
+# moves the 03-17 occurrence of the series to 03-19
+OVERRIDE = [
+    'UID:series-1',
+    'SUMMARY:AA session',
+    'RECURRENCE-ID;TZID=America/Vancouver:20250317T100000',
+    'DTSTART;TZID=America/Vancouver:20250319T100000',
+    'DTEND;TZID=America/Vancouver:20250319T113000',
+]
+
+
+@pytest.fixture
+def feed():
+    # stand-in calendar server answering If-None-Match with 304
+    body = calendar(ONE_OFF, OVERRIDE)
+    etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+    requests = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.headers.get('If-None-Match') == etag:
+                requests.append(304)
+                self.send_response(304)
+                self.end_headers()
+                return
+            requests.append(200)
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/feed.ics', body, requests
+    server.shutdown()
+    server.server_close()
+
+
+def test_unchanged_feed_reuses_cached_copy(tmp_path, feed):
+    url, body, requests = feed
+    cache_dir = str(tmp_path / 'sources')
+
+    path, changed = fetch_url(url, cache_dir)
+    assert changed
+    path_again, changed_again = fetch_url(url, cache_dir)
+    assert not changed_again
+    assert path_again == path
+    assert requests == [200, 304]
+    with open(path, 'rb') as f:
+        assert f.read() == body
+
+
+def test_sources_are_deduplicated_and_overrides_applied(tmp_path, client_list, feed):
+    url, _, requests = feed
+    local = tmp_path / 'local.ics'
+    # the one-off is in both sources
+    local.write_bytes(calendar(SERIES, ONE_OFF))
+
+    for _ in range(2):
+        parser = IcalParser([str(local), url], client_list, logger_level=logging.WARNING,
+                            month_range=((2025, 3), (2025, 3)), source_cache_dir=str(tmp_path / 'sources'))
+        assert [item[0] for item in line_items(parser, 'AA')] == [
+            '2025-03-03', '2025-03-10', '2025-03-19', '2025-03-24', '2025-03-31']
+        assert line_items(parser, 'MLS') == [('2025-03-20', 3.0, False)]
+
+    assert requests == [200, 304]
@@ -0,0 +1,26 @@
+import os
+import stat
+import zipfile
+
+from output_writer import FILE_MODE, OutputWriter, write_output_file
+from sharding import write_manifest
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_published_files_respect_the_umask(tmp_path):
+    # mkstemp temp files are 0600, invoices must be readable like a plain open() would leave them
+    markdown = write_output_file(str(tmp_path / 'march' / 'Alice A_03_2025.md'), '# invoice')
+    manifest = write_manifest(str(tmp_path / 'shards' / 'shard-1-of-2.json'), {'shard': 1})
+
+    archive_path = str(tmp_path / 'april' / 'invoices_04_2025.zip')
+    with OutputWriter(archive_path, str(tmp_path)) as writer:
+        writer.write(str(tmp_path / 'april' / 'pdfs' / 'Alice A_04_2025.pdf'), b'%PDF')
+        writer.write(str(tmp_path / 'april' / 'Alice A_04_2025.md'), '# invoice', archived=False)
+
+    for path in (markdown, manifest, archive_path, str(tmp_path / 'april' / 'Alice A_04_2025.md')):
+        assert mode(path) == FILE_MODE
+    with zipfile.ZipFile(archive_path) as archive:
+        assert archive.namelist() == ['april/pdfs/Alice A_04_2025.pdf']
@@ -0,0 +1,70 @@
+import logging
+
+from conftest import calendar, line_items
+from ical_parser import IcalParser
+
+# weekly 10:00-11:30 in Vancouver, crosses the 2025-03-09 DST change
+SERIES = [
+    'UID:series-1',
+    'SUMMARY:AA session',
+    'DTSTART;TZID=America/Vancouver:20250303T100000',
+    'DTEND;TZID=America/Vancouver:20250303T113000',
+    'RRULE:FREQ=WEEKLY;COUNT=5',
+]
+
+
+def march(tmp_path, client_list, *events):
+    ical_path = tmp_path / 'calendar.ics'
+    ical_path.write_bytes(calendar(SERIES, *events))
+    return IcalParser(str(ical_path), client_list, logger_level=logging.WARNING, month_range=((2025, 3), (2025, 3)))
+
+
+def test_utc_copy_of_tzid_occurrence_is_a_duplicate(tmp_path, client_list):
+    # 10:00 PDT on 03-10 exported in UTC
+    parser = march(tmp_path, client_list, [
+        'UID:copy-1',
+        'SUMMARY:AA session',
+        'DTSTART:20250310T170000Z',
+        'DTEND:20250310T183000Z',
+    ])
+
+    items = line_items(parser, 'AA')
+    assert [item[0] for item in items] == ['2025-03-03', '2025-03-10', '2025-03-17', '2025-03-24', '2025-03-31']
+    assert all(item[1] == 1.5 for item in items)
+    assert [finding['type'] for finding in parser.overlap_findings['AA']] == ['duplicate']
+
+
+def test_parking_notes_set_parking_on_the_session(tmp_path, client_list):
+    parser = march(tmp_path, client_list, [
+        # all-day note, sorts before the session
+        'UID:note-1',
+        'SUMMARY:AA park',
+        'DTSTART;VALUE=DATE:20250310',
+        'DTEND;VALUE=DATE:20250311',
+    ], [
+        # short note just before the session
+        'UID:note-2',
+        'SUMMARY:AA paid parking',
+        'DTSTART;TZID=America/Vancouver:20250317T094500',
+        'DTEND;TZID=America/Vancouver:20250317T100000',
+    ])
+
+    assert line_items(parser, 'AA') == [
+        ('2025-03-03', 1.5, False),
+        ('2025-03-10', 1.5, True),
+        ('2025-03-17', 1.5, True),
+        ('2025-03-24', 1.5, False),
+        ('2025-03-31', 1.5, False),
+    ]
+    assert [finding['type'] for finding in parser.overlap_findings['AA']] == ['annotation', 'annotation']
+
+
+def test_parking_note_without_a_session_is_billed(tmp_path, client_list):
+    parser = march(tmp_path, client_list, [
+        'UID:one-off-1',
+        'SUMMARY:AA park',
+        'DTSTART;TZID=America/Vancouver:20250312T090000',
+        'DTEND;TZID=America/Vancouver:20250312T100000',
+    ])
+
+    assert ('2025-03-12', 1.0, True) in line_items(parser, 'AA')
@@ -0,0 +1,62 @@
+from datetime import date, datetime
+import random
+from types import SimpleNamespace
+
+import pytest
+from dateutil import rrule as du
+
+from recurrence import expand_occurrences
+
+WEEKDAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+FREQS = {'DAILY': du.DAILY, 'WEEKLY': du.WEEKLY, 'MONTHLY': du.MONTHLY}
+
+
+def random_rule(rng, freq):
+    # returns (series starting on an ordinal, matching dateutil rrule)
+    start = date(2024, 1, 1).toordinal() + rng.randint(0, 400)
+    interval = rng.randint(1, 4)
+    count = rng.choice([None, None, rng.randint(1, 40)])
+    until = rng.choice([None, start + rng.randint(0, 600)]) if count is None else None
+    byday = ()
+    bymonthday = ()
+    kwargs = {}
+
+    roll = rng.random()
+    if freq in ('DAILY', 'WEEKLY') and roll < 0.5:
+        days = rng.sample(range(7), rng.randint(1, 4))
+        byday = tuple(WEEKDAYS[day] for day in days)
+        kwargs['byweekday'] = [du.weekdays[day] for day in days]
+    elif freq == 'MONTHLY' and roll < 0.3:
+        bymonthday = tuple(rng.sample([1, 5, 15, 28, 29, 30, 31, -1, -2], 2))
+        kwargs['bymonthday'] = list(bymonthday)
+    elif freq == 'MONTHLY' and roll < 0.6:
+        nth, day = rng.choice([1, 2, 3, 4, -1]), rng.randrange(7)
+        byday = (f'{nth}{WEEKDAYS[day]}',)
+        kwargs['byweekday'] = [du.weekdays[day](nth)]
+
+    event = SimpleNamespace(start=start, rdates=frozenset(), exdates=frozenset(), rrule={
+        'freq': freq, 'interval': interval, 'until': until, 'count': count, 'byday': byday, 'bymonthday': bymonthday,
+    })
+    expected = du.rrule(FREQS[freq], dtstart=datetime.fromordinal(start), interval=interval, count=count,
+                        until=datetime.fromordinal(until) if until is not None else None, wkst=du.MO, **kwargs)
+    return event, expected
+
+
+@pytest.mark.parametrize('freq', sorted(FREQS))
+def test_expansion_matches_dateutil(freq):
+    rng = random.Random(freq)
+    mismatches = []
+    for _ in range(2000):
+        event, expected = random_rule(rng, freq)
+        window_start = event.start + rng.randint(-100, 500)
+        window_end = window_start + rng.randint(1, 90)
+
+        want = [occurrence.toordinal() for occurrence in expected.between(
+            datetime.fromordinal(window_start), datetime.fromordinal(window_end), inc=True)
+            if occurrence.toordinal() < window_end]
+        got = expand_occurrences(event, window_start, window_end)
+        if got != want:
+            mismatches.append((event.rrule, date.fromordinal(event.start), date.fromordinal(window_start),
+                               date.fromordinal(window_end)))
+
+    assert not mismatches, mismatches[:5]
@@ -0,0 +1,61 @@
+import logging
+
+import pytest
+
+from conftest import calendar, line_items
+from ical_parser import IcalParser
+
+SERIES = [
+    'UID:series-1',
+    'SUMMARY:AA session',
+    'DTSTART;TZID=America/Vancouver:20250303T100000',
+    'DTEND;TZID=America/Vancouver:20250303T113000',
+    'RRULE:FREQ=WEEKLY;UNTIL=20250501T000000Z',
+]
+
+# the 03-31 occurrence moved to 04-01
+MOVED = [
+    'UID:series-1',
+    'SUMMARY:AA session',
+    'RECURRENCE-ID;TZID=America/Vancouver:20250331T100000',
+    'DTSTART;TZID=America/Vancouver:20250401T100000',
+    'DTEND;TZID=America/Vancouver:20250401T113000',
+]
+
+
+def load(ical_path, client_list, month, stream):
+    return IcalParser(ical_path, client_list, logger_level=logging.WARNING, stream=stream,
+                      month_range=((2025, month), (2025, month)))
+
+
+@pytest.mark.parametrize('month', [3, 4])
+def test_moved_occurrence_stream_matches_full_load(tmp_path, client_list, month):
+    ical_path = tmp_path / 'moved.ics'
+    ical_path.write_bytes(calendar(SERIES, MOVED))
+
+    full = line_items(load(str(ical_path), client_list, month, stream=False), 'AA')
+    streamed = line_items(load(str(ical_path), client_list, month, stream=True), 'AA')
+
+    assert streamed == full
+    dates = [item[0] for item in full]
+    assert '2025-03-31' not in dates
+    assert ('2025-04-01' in dates) == (month == 4)
+
+
+def test_filter_keeps_events_the_full_load_bills(tmp_path, client_list):
+    # a quoted colon in a SUMMARY parameter and lowercase BEGIN/END must not hide a session
+    ics = calendar([
+        'UID:altrep-1',
+        'SUMMARY;ALTREP="http://x/y":AA park',
+        'DTSTART;TZID=America/Vancouver:20250320T100000',
+        'DTEND;TZID=America/Vancouver:20250320T113000',
+    ]).replace(b'END:VCALENDAR', b'begin:vevent\r\nUID:lower-1\r\nSUMMARY:AA session\r\n'
+                                 b'DTSTART:20250325T170000Z\r\nDTEND:20250325T183000Z\r\nend:vevent\r\nEND:VCALENDAR')
+    ical_path = tmp_path / 'quoted.ics'
+    ical_path.write_bytes(ics)
+
+    full = line_items(load(str(ical_path), client_list, 3, stream=False), 'AA')
+    streamed = line_items(load(str(ical_path), client_list, 3, stream=True), 'AA')
+
+    assert streamed == full
+    assert [item[0] for item in full] == ['2025-03-20', '2025-03-25']